@@ -10,7 +10,14 @@
 
 from lib.reporter import Reporter
 from lib.analytics import Analytics
-from lib.util import read_config_file, save_to_json_file, print_to_stdout
+from lib.findings import FindingsStore
+from lib.sinks import get_results_sink
+from lib.util import read_config_file, print_to_stdout, set_json_codec
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
 # TODO: Add CLI with ArgParse
@@ -21,6 +28,9 @@ def main():
 
     config = read_config_file()
 
+    # Reports and results are read and saved with the fastest JSON codec installed.
+    print_to_stdout("Using the {0} JSON codec.".format(set_json_codec(config.get("json_codec", "auto"))))
+
     ######################################################
     #                                                    #
     #   Step 1: Fetch all resources' reports from GCP.   #
@@ -28,7 +38,23 @@ def main():
     ######################################################
 
     reporter = Reporter(config)
-    reports, previous_reports = reporter.run()
+
+    if config.get("pipeline"):
+
+        ### Analyze every resource's report as soon as it is fetched: check
+        ### for differences and each custom rules against it.
+        analyzer = Analytics(reporter.reports, reporter.previous_reports, manifest=reporter.manifest,
+                             full_report=config.get("results_full_report", False))
+
+        report_queue = queue.Queue(maxsize=config.get("pipeline_queue_size", 100))
+        analyzer.start_stream(report_queue)
+
+        reporter.run(report_queue)
+
+        diff_project_report, rules_violation_report = analyzer.finish_stream()
+
+    else:
+        reports, previous_reports = reporter.run()
 
 
     ######################################################
@@ -37,17 +63,19 @@ def main():
     #                                                    #
     ######################################################
 
-    analyzer = Analytics(reports, previous_reports)
+    if not config.get("pipeline"):
+
+        analyzer = Analytics(reports, previous_reports, workers=config.get("analytics_workers", 1),
+                             chunk_size=config.get("analytics_chunk_size", 0),
+                             full_report=config.get("results_full_report", False))
 
-    ### Check for differences in each resource's report.
-    diff_project_report = analyzer.check_diff_projects()
+        ### Check for differences in each resource's report, and each custom
+        ### rules against it, loading every report once.
+        diff_project_report, rules_violation_report = analyzer.analyze_reports()
 
     ### Check whether a new project was added/removed.
     new_project_report = analyzer.check_number_projects()
 
-    ### Check each custom rules against each resource's report.
-    rules_violation_report = analyzer.check_custom_rules()
-
     ### Check against GCP warnings.
     warning_report = analyzer.check_warnings(reporter.warnings)
 
@@ -59,12 +87,26 @@ def main():
     ######################################################
     results = diff_project_report + new_project_report + rules_violation_report + warning_report
 
+    ### Only save the findings that are new or were resolved since the last run.
+    if config.get("findings_db"):
+        with FindingsStore(config["findings_db"]) as findings:
+            new_findings, resolved_findings, open_findings, events = findings.update(results, reporter.run_id,
+                                                                                      analyzer.report_names)
+
+        print_to_stdout("{0} new, {1} resolved and {2} still open findings, and {3} events.".format(len(new_findings), \
+                                    len(resolved_findings), len(open_findings), len(events)), color="green")
+
+        results = events + new_findings + resolved_findings
+        if config.get("findings_emit_open"):
+            results += open_findings
+
 
-    for result in results:
-        save_to_json_file(result, reporter.results, mode="a")
+    with get_results_sink(config, reporter.results, reporter.run_id) as sink:
+        for result in results:
+            sink.write(result)
 
-    print_to_stdout("Results for {0} resources were saved to {1}. Exiting...".format(len(analyzer.report_names), \
-                                    reporter.results), color="green")
+    print_to_stdout("Results for {0} resources were saved ({1} results). Exiting...".format(len(analyzer.report_names), \
+                                    sink.count), color="green")
 
 
 
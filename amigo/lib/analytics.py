@@ -8,109 +8,288 @@
 
 
 import util
+import threading
+from multiprocessing import Pool
+from diff import diff_resources, has_diff, get_match_key
+from manifest import ReportManifest, get_changed_resources, get_changed_keys
+from rules import load_rules
+
+
+# Analytics instance of each worker process of the pool.
+_worker_analytics = None
+
+
+def _init_worker(reports_path, previous_reports_path, rules_file, full_report):
+    """
+        Load the manifests and compile the rules once in every worker process.
+    """
+    global _worker_analytics
+
+    _worker_analytics = Analytics(reports_path, previous_reports_path, full_report=full_report)
+    _worker_analytics.rules_file = rules_file
+    _worker_analytics.get_rule_set()
+
+
+def _analyze_report_task(task):
+    """
+        Analyze a report in a worker process, given (project, attribute, diff, rules).
+    """
+    return _worker_analytics.analyze_report(*task)
 
 
 class Analytics():
 
-    def __init__(self, reports_path, previous_reports_path):
+    def __init__(self, reports_path, previous_reports_path, workers=1, chunk_size=0, manifest=None, full_report=False):
 
-        # These are used to save the new fetched report and to retrieve the previous one.
-        self.report_list = util.list_files_in_dir(reports_path , "*.json")
-        self.previous_report_list = util.list_files_in_dir(previous_reports_path, "*.json")
+        self.reports_path = reports_path
+        self.previous_reports_path = previous_reports_path
+
+        # These index the new fetched reports and the previous ones by (project, attribute).
+        # The manifest of the reports can be shared with the Reporter still fetching them.
+        self.manifest = manifest if manifest is not None else ReportManifest(reports_path)
+        self.previous_manifest = ReportManifest(previous_reports_path)
 
         # These are used to check new projects/resources.
-        self.report_names = set()
-        self.previous_report_names = set()
+        self.report_names = self.manifest.keys()
+        self.previous_report_names = self.previous_manifest.keys()
 
         self.rules_file = "./rules.yaml"
+        self.rule_set = None
+
+        # Number of processes analyzing reports (1 analyzes them in this process),
+        # and number of reports sent to a process at once (0 picks it from the
+        # number of reports).
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        # Whether diff results have the whole current report (gcp_full_report).
+        self.full_report = full_report
+
+        # Results of the reports analyzed while they are fetched, keyed by (project, attribute).
+        self._stream_results = {}
+        self._stream_thread = None
+        self._stream_error = None
+
+
+    def get_rule_set(self):
+        """
+            Load and compile the custom rules from rules.yaml once.
+        """
+        if self.rule_set is None:
+            self.rule_set = load_rules(self.rules_file)
+
+        return self.rule_set
 
 
     ##############################################################################
     #                                                                            #
-    #   The first heuristics is to extract any diff in the resources' reports.   #
+    #   Every report is analyzed on its own, so reports can be spread over a     #
+    #   pool of processes. Results are merged in the order of the reports.       #
     #                                                                            #
     ##############################################################################
-    def _parse_jsondiff_reports(self, diff):
+    def analyze_report(self, project, attribute, diff=True, rules=True):
         """
-            Parse jsondiff diff strings to prettify it.
+            Diff a report against its previous version and check it against
+            the custom rules, walking its resources one at a time. Return the
+            diff and violation results.
         """
-        diff_report = []
-        original_str_list = ["$update", "$delete", "$insert"]
+        diff_results = []
+        violation_results = []
+
+        if diff and (project, attribute) in self.previous_report_names:
+            result = self._diff_report(project, attribute)
+            if result:
+                diff_results.append(result)
+
+        if rules and self.get_rule_set().get_rules(attribute):
+            data = util.iter_jsonl_file(self.manifest.get_report_path(project, attribute))
+            violation_results = self._check_report_rules(project, attribute, data)
+
+        return diff_results, violation_results
 
-        def _parser(original_str):
 
-            # Strings come from jsondiff repors in the "$update" format.
-            pretty_str = original_str.strip("$").title()
+    def _get_chunk_size(self, tasks):
+        """
+            Return the number of reports sent to a process at once, so that
+            every process gets a few chunks.
+        """
+        return self.chunk_size or max(1, len(tasks) // (self.workers * 4))
+
+
+    def analyze_reports(self, keys=None, diff=True, rules=True):
+        """
+            Analyze the given reports (every report by default), in a pool of
+            processes if there is more than one worker. Return the diff and
+            violation results, in the same order as the serial path.
+        """
+        tasks = [(project, attribute, diff, rules) for project, attribute in sorted(self.report_names if keys is None else keys)]
 
-            if original_str in diff:
-                new_list = diff[original_str]
+        diff_results = []
+        violation_results = []
 
-                for item in new_list:
-                    diff_report.append("{0} resource: {1}".format(pretty_str, item))
+        if self.workers > 1 and len(tasks) > 1:
+            util.print_to_stdout("Analyzing {0} reports with {1} processes.".format(len(tasks), self.workers))
 
+            pool = Pool(processes=self.workers, initializer=_init_worker,
+                        initargs=(self.reports_path, self.previous_reports_path, self.rules_file, self.full_report))
 
-        for original_str in original_str_list:
-            _parser(original_str)
+            try:
+                results = list(pool.imap(_analyze_report_task, tasks, self._get_chunk_size(tasks)))
 
-        return diff_report
+            finally:
+                pool.close()
+                pool.join()
 
+        else:
+            results = [self.analyze_report(*task) for task in tasks]
 
-    def _generate_diff_projects_report(self, resource, attribute, diff, data):
+        for report_diff_results, report_violation_results in results:
+            diff_results.extend(report_diff_results)
+            violation_results.extend(report_violation_results)
+
+        return diff_results, violation_results
+
+
+    def _consume_stream(self, report_queue):
+        """
+            Analyze every (project, attribute) taken from the queue, until None
+            is taken. If the analysis fails, the queue is still drained, so that
+            the Reporter is never blocked on it.
+        """
+        while True:
+            key = report_queue.get()
+            if key is None:
+                return
+
+            if self._stream_error is not None:
+                continue
+
+            try:
+                self._stream_results[key] = self.analyze_report(*key)
+
+            except Exception as e:
+                util.print_to_stderr("Analysis of {0} for {1} failed: {2}".format(key[1], key[0], e))
+                self._stream_error = e
+
+
+    def start_stream(self, report_queue):
+        """
+            Start analyzing the reports put in the queue (as (project, attribute)
+            tuples) by the Reporter, as soon as they are saved.
+        """
+        self._stream_results = {}
+        self._stream_error = None
+
+        self._stream_thread = threading.Thread(target=self._consume_stream, args=(report_queue,))
+        self._stream_thread.daemon = True
+        self._stream_thread.start()
+
+
+    def finish_stream(self):
+        """
+            Wait for the reports in the queue to be analyzed and return the diff
+            and violation results, in the same order as analyze_reports.
+        """
+        self._stream_thread.join()
+
+        if self._stream_error is not None:
+            raise self._stream_error
+
+        # Index the reports fetched meanwhile, to check new projects/resources.
+        self.report_names = self.manifest.keys()
+
+        diff_results = []
+        violation_results = []
+
+        for key in sorted(self._stream_results):
+            report_diff_results, report_violation_results = self._stream_results[key]
+            diff_results.extend(report_diff_results)
+            violation_results.extend(report_violation_results)
+
+        return diff_results, violation_results
+
+
+    ##############################################################################
+    #                                                                            #
+    #   The first heuristics is to extract any diff in the resources' reports.   #
+    #                                                                            #
+    ##############################################################################
+    def _generate_diff_projects_report(self, resource, attribute, diff, data=None):
         """
             Create a report for every diff found in the resources' reports.
+            The diff has the added, removed and changed resources, and the
+            whole report is added if it is given.
         """
-        return {
+        report = {
                     "name":"Difference in Resources",
                     "resource":resource,
                     "attribute":attribute,
-                    "diff":self._parse_jsondiff_reports(diff),
-                    "gcp_full_report":data
+                    "diff":diff
                  }
 
+        if data is not None:
+            report["gcp_full_report"] = data
 
-    def _retrieve_reports_to_be_compared(self, report_file):
-        """
-            Loop over the previous reports to find the current report
-            and retrieve and return this data.
-        """
-        for previous_report_path in self.previous_report_list:
+        return report
 
-                previous_report_file = util.get_basename_file(previous_report_path)
 
-                if report_file == previous_report_file:
-                    previous_data = util.read_json_file(previous_report_path)
+    def _get_resource_hashes(self, report_path):
+        """
+            Return the hash of every resource of a report keyed by the resource
+            key, reading one resource at a time.
+        """
+        return dict((get_match_key(item), util.get_content_hash(item)) for item in util.iter_jsonl_file(report_path))
 
-                    return previous_data, previous_report_file
 
-        return None, None
+    def _iter_changed_resources(self, report_path, changed_keys):
+        """
+            Yield the resources of a report whose keys are in changed_keys.
+        """
+        for item in util.iter_jsonl_file(report_path):
+            if get_match_key(item) in changed_keys:
+                yield item
 
 
-    def check_diff_projects(self):
+    def _diff_report(self, resource, attribute):
         """
-            Load every current and previous attribute reports and
-            creates a report if any diff is found.
+            Diff a report against its previous version, keeping only the
+            resources that changed in memory. Reports with the same hash in
+            both manifests are not read, and reports without hashes (saved
+            by older runs) are hashed one resource at a time first. Return
+            the diff report, or None.
         """
-        results = []
+        changed_keys = get_changed_resources(self.manifest.get(resource, attribute),
+                                             self.previous_manifest.get(resource, attribute))
+        if changed_keys is not None and not changed_keys:
+            return None
 
-        for report_path in self.report_list:
+        report_path = self.manifest.get_report_path(resource, attribute)
+        previous_report_path = self.previous_manifest.get_report_path(resource, attribute)
 
-            report_file = util.get_basename_file(report_path)
-            self.report_names.add(report_file)
+        if changed_keys is None:
+            changed_keys = get_changed_keys(self._get_resource_hashes(report_path),
+                                            self._get_resource_hashes(previous_report_path))
 
-            resource, attribute = util.extract_resource_info(report_file)
+        diff = diff_resources(self._iter_changed_resources(previous_report_path, changed_keys),
+                              self._iter_changed_resources(report_path, changed_keys))
 
-            data = util.read_json_file(report_path)
-            previous_data, previous_report_file = self._retrieve_reports_to_be_compared (report_file)
+        if not has_diff(diff):
+            return None
 
-            if previous_data:
-                self.previous_report_names.add(previous_report_file)
-                diff = util.jsonfy(util.get_diff_dicts(data, previous_data))
+        util.print_to_stdout("Found diff for {0} in {1}.".format(attribute, resource), color="green")
 
-                if diff:
-                    util.print_to_stdout("Found diff for {0} in {1}.".format(attribute, resource), color="green")
-                    results.append(self._generate_diff_projects_report(resource, attribute, diff, data))
+        data = util.read_jsonl_file(report_path) if self.full_report else None
 
-        return results
+        return self._generate_diff_projects_report(resource, attribute, diff, data)
+
+
+    def check_diff_projects(self):
+        """
+            Load every current and previous attribute reports and
+            creates a report if any diff is found. Reports are paired
+            through the manifests.
+        """
+        return self.analyze_reports(self.report_names & self.previous_report_names, rules=False)[0]
 
 
     ######################################################################################
@@ -139,8 +318,7 @@ class Analytics():
 
         if new_projects:
 
-            for project_path in new_projects:
-                resource, attribute = util.extract_resource_info(project_path)
+            for resource, attribute in sorted(new_projects):
                 results.append(self._generate_number_projects_report(resource, attribute))
 
             util.print_to_stdout("Before there were {0} resources being reported, now there are {1}.".format(\
@@ -167,96 +345,27 @@ class Analytics():
                  }
 
 
-    def _get_resources_list(self, resource_name):
+    def _check_report_rules(self, project, resource, data):
         """
-            Search for a all the reports for a given resource,
-            loading and returning them in a list.
+            Check every resource of a report against all of its rules.
         """
-        resources_list = []
-
-        for report_path in self.report_list:
-
-            project, resource = util.extract_resource_info(util.get_basename_file(report_path))
-
-            if resource_name == resource:
-                resources_list.append([project, util.read_json_file(report_path)])
-
-        return resources_list
-
-
-    def _parse_firewall_value(self, resource_data, rule_items):
-        """
-            Parse custom rules and check the resource data, returning any violation.
-        """
-
-        for rule_item in rule_items:
-            for key, value in rule_item.items():
-
-                try:
-                    violation1 =  key == "sourceRanges" and any(n in value for n in resource_data["sourceRanges"])
-                    print 'hit sourcerange ', key, value, resource_data["sourceRanges"][0]
-
-                    violation2 =  key == "IPProtocol" and any(n in value for n in resource_data["allowed"][0]["IPProtocol"])
-                    print 'hit IPProtocol ', key, value, resource_data["allowed"][0]["IPProtocol"]
-
-                    violation3 = key == "ports" and any(n in value for n in resource_data['allowed'][1]['ports'])
-                    print 'hit ports ', key, value, resource_data['allowed'][2]['ports']
-
-                except (KeyError, IndexError, TypeError) as e:
-                    pass
-
-        return violation1 or violation2 or violation3
-
-
-    def _do_keyvalue_rule(self, rule_name, rule):
-        """
-            A key-value rule is simple a rule that checks whether a
-            given value is in the resources' report, given its key.
-        """
-        try:
-            resource = rule["violation_resource"]
-            rule_items = rule["violation"]
-
-        except KeyError:
-            util.print_to_stderr("Rule {0} is ill-formatted in the {1}.".format(rule_name, self.rules_file))
-
-        resources_list = self._get_resources_list(resource)
-
         results = []
+        rule_set = self.get_rule_set()
 
-        for project, resource_data in resources_list:
-
-            # To do  add other types of rules besides firewall.
-            if resource == "firewalls":
-                if self._parse_firewall_value(resource_data, rule_items):
-                    results.append(self._generate_violation_rules_report(project, resource_data))
+        for resource_data in data:
+            for rule in rule_set.evaluate(resource_data, resource):
+                violation = {"rule": rule.name, "resource_data": resource_data}
+                results.append(self._generate_violation_rules_report(project, resource, violation))
 
         return results
 
 
     def check_custom_rules(self):
         """
-           Load custom rules from rules.yaml files check every rule
-           violation over every resources' report.
+           Check every resource of each report against all of its custom
+           rules from rules.yaml, reading every report only once.
         """
-        results = []
-        rules = util.read_yaml_file(self.rules_file)
-
-        try:
-            for rule_name, rule in rules.items():
-
-                if util.get_value(rule, "rule_type") == "key_value":
-
-                    # All types of rules go here.
-                    result = self._do_keyvalue_rule(rule_name, rule)
-                    if result:
-                        results.append(result)
-
-        except AttributeError:
-            util.print_to_stdout("Rule file ('{0}') is ill-formatted.".format(self.rules_file))
-
-
-        return results
+        return self.analyze_reports(diff=False)[1]
 
 
     #############################################################################
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   blobstore.py
+#
+#   Content-addressed store of compressed reports, shared by every run.
+#   A report is saved once under its content hash, and the reports
+#   directory of a run only has a manifest pointing to the blobs, so a
+#   report that did not change between days takes no extra space.
+#
+
+import os
+import uuid
+import util
+import threading
+
+
+BLOBS_DIR = "blobs"
+BLOB_EXTENSION = ".jsonl.gz"
+
+
+class BlobStore():
+
+    def __init__(self, store_dir):
+
+        self.store_dir = store_dir
+
+        # Directories are created by many fetch threads.
+        self._lock = threading.Lock()
+
+
+    def _create_dir(self, dir_path):
+        """
+            Create a directory of the store if it does not exist.
+        """
+        with self._lock:
+            util.create_dir(dir_path)
+
+
+    def get_path(self, blob):
+        """
+            Return the path of a blob given its name (its hash and extension).
+            Blobs are spread over directories by the first characters of the
+            hash. Blobs named by their hash alone are gzip compressed.
+        """
+        if "." not in blob:
+            blob += BLOB_EXTENSION
+
+        return os.path.join(self.store_dir, blob[:2], blob)
+
+
+    def has(self, blob):
+        """
+            Return True if the store has a blob.
+        """
+        return util.is_file(self.get_path(blob))
+
+
+    def get_temp_path(self, name, extension=BLOB_EXTENSION):
+        """
+            Return a unique path in the store where a blob can be written
+            before its hash is known.
+        """
+        temp_dir = os.path.join(self.store_dir, "tmp")
+        self._create_dir(temp_dir)
+
+        return os.path.join(temp_dir, "{0}.{1}{2}".format(name, uuid.uuid4().hex, extension))
+
+
+    def add_file(self, file_path, blob):
+        """
+            Move a compressed file written to a temporary path into the store
+            under its name, removing it if the store already has the blob.
+            Return the path of the blob.
+        """
+        blob_path = self.get_path(blob)
+
+        if util.is_file(blob_path):
+            os.remove(file_path)
+
+        else:
+            self._create_dir(os.path.dirname(blob_path))
+            os.rename(file_path, blob_path)
+
+        return blob_path
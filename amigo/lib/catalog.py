@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   catalog.py
+#
+#   Catalog of the snapshots (runs) saved in the reports directory, with
+#   their timestamps, status and counts. It is used to select the baseline
+#   a run is compared against, without probing the disk for dated reports.
+#
+
+import util
+import datetime
+
+
+CATALOG_FILE = "catalog.json"
+
+
+class SnapshotCatalog():
+
+    def __init__(self, reports_dir):
+
+        self.reports_dir = reports_dir
+        self.catalog_file = util.get_full_path(reports_dir, CATALOG_FILE)
+
+        # Runs keyed by run ID.
+        self.runs = {}
+
+        # Indexes for the baseline lookups.
+        self.last_successful = None
+        self.successful_by_date = {}
+
+        self._load()
+
+
+    def _load(self):
+        """
+            Load the catalog file, or index the dated report directories saved
+            before the catalog existed as successful runs.
+        """
+        self.runs = {}
+
+        if util.is_file(self.catalog_file):
+            for run in util.read_json_file(self.catalog_file) or []:
+                self.runs[run["run_id"]] = run
+
+        elif util.is_path(self.reports_dir):
+            for reports_path in util.list_files_in_dir(self.reports_dir, "????_??_??"):
+                run_id = util.get_basename_file(reports_path)
+                self.runs[run_id] = {"run_id": run_id, "reports": reports_path, "status": "success"}
+
+        self._index()
+
+
+    def _index(self):
+        """
+            Index the successful runs: the last one, and the last one of each day.
+        """
+        self.last_successful = None
+        self.successful_by_date = {}
+
+        for run_id in sorted(self.runs):
+            if self.runs[run_id]["status"] == "success":
+                self.last_successful = run_id
+                self.successful_by_date[run_id[:10]] = run_id
+
+
+    def _update(self, run):
+        """
+            Add or replace a run, saving the catalog. The file is loaded again
+            first, so that runs saved meanwhile by other processes are kept.
+        """
+        self._load()
+        self.runs[run["run_id"]] = run
+        self._index()
+
+        util.save_to_json_file([self.runs[run_id] for run_id in sorted(self.runs)], self.catalog_file, atomic=True)
+
+
+    def start_run(self, run_id, reports_path):
+        """
+            Register a new run, which is not used as a baseline until it succeeds.
+        """
+        self._update({
+                       "run_id": run_id,
+                       "reports": reports_path,
+                       "status": "running",
+                       "started": datetime.datetime.now().isoformat(),
+                     })
+
+
+    def finish_run(self, run_id, status, counts=None):
+        """
+            Register the end of a run, with its status ("success" or "failed")
+            and counts (e.g. number of projects and reports).
+        """
+        run = dict(self.runs.get(run_id) or {"run_id": run_id})
+        run["status"] = status
+        run["finished"] = datetime.datetime.now().isoformat()
+        run["counts"] = counts or {}
+
+        self._update(run)
+
+
+    def get_run(self, run_id):
+        """
+            Return a run given its ID, or None.
+        """
+        return self.runs.get(run_id)
+
+
+    def select_baseline(self, baseline="last_successful"):
+        """
+            Return the run to be compared against, or None. The baseline is
+            "last_successful", "days_ago:<N>" (the last successful run of N
+            days ago) or "run:<run ID>" (only if that run succeeded).
+        """
+        if baseline == "last_successful":
+            run_id = self.last_successful
+
+        elif baseline.startswith("days_ago:"):
+            try:
+                run_id = self.successful_by_date.get(util.get_date(int(baseline.split(":", 1)[1])))
+
+            except ValueError:
+                util.print_to_stderr("Baseline {0} is not valid.".format(baseline))
+                run_id = None
+
+        elif baseline.startswith("run:"):
+            run_id = baseline.split(":", 1)[1]
+
+            # Failed or unfinished runs may have partial reports.
+            if run_id in self.runs and self.runs[run_id]["status"] != "success":
+                util.print_to_stderr("Baseline run {0} did not succeed ({1}).".format(run_id, self.runs[run_id]["status"]))
+                run_id = None
+
+        else:
+            util.print_to_stderr("Baseline {0} is not valid.".format(baseline))
+            run_id = None
+
+        return self.runs.get(run_id)
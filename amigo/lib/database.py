@@ -4,19 +4,49 @@
 #   database.py
 #
 #   Class for Amigo's database. This class wraps
-#   the methods from TinyDB and make it easier for
-#   changing the intrinsic database in the future
-#   if we have issues with scalability.
+#   the methods from the storage engines (TinyDB or
+#   SQLite) and make it easier for changing the
+#   intrinsic database if we have issues with scalability.
 #
 
+import util
+import sqlite3
+import itertools
+import threading
+import collections
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 from tinydb import TinyDB, Query
 
 
-class Database():
+# TinyDB keeps items without a table in this one.
+DEFAULT_TABLE = "_default"
+
+# TinyDB rewrites the whole file on every write, so its writes are always
+# buffered in batches of at least this size.
+TINYDB_BATCH_SIZE = 100
+
+
+def get_item_key(item):
+    """
+        Return the value that identifies an item (e.g. the projectId of a
+        project or the selfLink of a firewall), or None if there is none.
+    """
+    for key in ("projectId", "selfLink", "id", "name"):
+        if key in item:
+            return str(item[key])
+
+    return None
+
 
-    def __init__(self, db_json_file):
+class TinyDBEngine():
 
-        self.database = TinyDB(db_json_file)
+    def __init__(self, db_path):
+
+        self.database = TinyDB(db_path)
 
 
     def get_table(self, table):
@@ -26,15 +56,457 @@ class Database():
         return self.database.table(table).all()
 
 
+    def get_item(self, table, key):
+        """
+            Return the items of a table identified by a given key.
+        """
+        return [item for item in self.get_table(table) if get_item_key(item) == key]
+
+
+    def insert_many(self, table, items):
+        """
+            Insert a list of items in a given table.
+        """
+        self.database.table(table).insert_multiple(items)
+
+
+    def _get_snapshot_table(self, table, snapshot):
+        """
+            Snapshots are kept as tables named "<table>@<snapshot>".
+        """
+        return self.database.table("{0}@{1}".format(table, snapshot))
+
+
+    def upsert_many(self, table, items, snapshot):
+        """
+            Insert a list of items in a snapshot of a table, replacing any
+            item with the same key.
+        """
+        snapshot_table = self._get_snapshot_table(table, snapshot)
+
+        # Keep the last item of every key in the batch.
+        merged = collections.OrderedDict()
+        for index, item in enumerate(items):
+            key = get_item_key(item)
+            merged[index if key is None else key] = item
+
+        # TinyDB rewrites the whole file on every change, so remove the
+        # items being replaced and insert the batch, instead of an upsert
+        # (and a write) per item.
+        keys = set(key for key in merged if not isinstance(key, int))
+        if keys:
+            snapshot_table.remove(lambda item: get_item_key(item) in keys)
+
+        snapshot_table.insert_multiple(merged.values())
+
+
+    def get_snapshots(self, table):
+        """
+            Return the sorted list of snapshots of a table.
+        """
+        prefix = table + "@"
+        return sorted(name[len(prefix):] for name in self.database.tables() if name.startswith(prefix))
+
+
+    def get_snapshot(self, table, snapshot):
+        """
+            Return the items of a table in a given snapshot.
+        """
+        return self._get_snapshot_table(table, snapshot).all()
+
+
+    def close(self):
+        """
+            Close the database file.
+        """
+        self.database.close()
+
+
+class SQLiteEngine():
+
+    def __init__(self, db_path):
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+
+        # WAL lets readers go on while we write, and a commit only needs
+        # to append to the log instead of rewriting the database.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        self.tables = set()
+
+        self._lock = threading.Lock()
+
+
+    def _get_table_name(self, table):
+        """
+            Return the table name quoted to be used in a statement.
+        """
+        return '"{0}"'.format(table.replace('"', '""'))
+
+
+    def _create_table(self, table):
+        """
+            Create a table (and its indexes) the first time it is used.
+            Items inserted without a snapshot have a NULL snapshot, while
+            items of a snapshot are unique by key.
+        """
+        if table in self.tables:
+            return
+
+        table_name = self._get_table_name(table)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS {0} "
+                                    "(id INTEGER PRIMARY KEY AUTOINCREMENT, item_key TEXT, data TEXT NOT NULL, "
+                                    "snapshot TEXT)".format(table_name))
+
+            self.connection.execute("CREATE INDEX IF NOT EXISTS {0} ON {1} (item_key)".format(
+                                    self._get_table_name(table + "_item_key"), table_name))
+            self.connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0} ON {1} (snapshot, item_key)".format(
+                                    self._get_table_name(table + "_snapshot"), table_name))
+
+        self.tables.add(table)
+
+
+    def get_table(self, table):
+        """
+            Return the items from a given table in the database.
+        """
+        with self._lock:
+            self._create_table(table)
+            rows = self.connection.execute("SELECT data FROM {0} WHERE snapshot IS NULL ORDER BY id".format(
+                                           self._get_table_name(table)))
+
+            return [util.json_loads(data) for data, in rows]
+
+
+    def get_item(self, table, key):
+        """
+            Return the items of a table identified by a given key.
+        """
+        with self._lock:
+            self._create_table(table)
+            rows = self.connection.execute("SELECT data FROM {0} WHERE item_key = ? AND snapshot IS NULL ORDER BY id".format(
+                                           self._get_table_name(table)), (key,))
+
+            return [util.json_loads(data) for data, in rows]
+
+
+    def insert_many(self, table, items):
+        """
+            Insert a list of items in a given table, in a single transaction.
+        """
+        with self._lock:
+            self._create_table(table)
+
+            with self.connection:
+                self.connection.executemany("INSERT INTO {0} (item_key, data) VALUES (?, ?)".format(self._get_table_name(table)),
+                                            ((get_item_key(item), util.json_dumps(item)) for item in items))
+
+
+    def upsert_many(self, table, items, snapshot):
+        """
+            Insert a list of items in a snapshot of a table, replacing any
+            item with the same key, in a single transaction.
+        """
+        with self._lock:
+            self._create_table(table)
+
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO {0} (item_key, data, snapshot) VALUES (?, ?, ?)".format(
+                                            self._get_table_name(table)),
+                                            ((get_item_key(item), util.json_dumps(item), snapshot) for item in items))
+
+
+    def get_snapshots(self, table):
+        """
+            Return the sorted list of snapshots of a table.
+        """
+        with self._lock:
+            self._create_table(table)
+            rows = self.connection.execute("SELECT DISTINCT snapshot FROM {0} WHERE snapshot IS NOT NULL ORDER BY snapshot".format(
+                                           self._get_table_name(table)))
+
+            return [snapshot for snapshot, in rows]
+
+
+    def get_snapshot(self, table, snapshot):
+        """
+            Return the items of a table in a given snapshot.
+        """
+        with self._lock:
+            self._create_table(table)
+            rows = self.connection.execute("SELECT data FROM {0} WHERE snapshot = ? ORDER BY id".format(
+                                           self._get_table_name(table)), (snapshot,))
+
+            return [util.json_loads(data) for data, in rows]
+
+
+    def close(self):
+        """
+            Close the connection to the database.
+        """
+        with self._lock:
+            self.connection.close()
+
+
+ENGINES = {
+    "tinydb": TinyDBEngine,
+    "sqlite": SQLiteEngine,
+}
+
+
+class Database():
+
+    def __init__(self, db_path, engine="tinydb", batch_size=1, flush_interval=5):
+
+        if engine not in ENGINES:
+            util.print_to_stderr("Database engine {0} does not exist, using tinydb.".format(engine))
+            engine = "tinydb"
+
+        self.database = ENGINES[engine](db_path)
+
+        # Writes are buffered and saved by a background writer in batches of
+        # batch_size items, or every flush_interval seconds. A batch size of
+        # 1 writes every item synchronously.
+        if engine == "tinydb":
+            batch_size = max(batch_size, TINYDB_BATCH_SIZE)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._queue = queue.Queue(maxsize=4)
+        self._writer = None
+
+        # First error of the background writer, raised on the next flush.
+        self._error = None
+
+        self._buffer_lock = threading.Lock()
+        self._engine_lock = threading.Lock()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+
+    def _write(self, operations):
+        """
+            Save a list of (operation, table, snapshot, item) in the engine,
+            grouping consecutive items of the same table in a single batch.
+        """
+        for (operation, table, snapshot), group in itertools.groupby(operations, key=lambda op: op[:3]):
+            items = [op[3] for op in group]
+
+            try:
+                with self._engine_lock:
+                    if operation == "upsert":
+                        self.database.upsert_many(table, items, snapshot)
+                    else:
+                        self.database.insert_many(table, items)
+
+            except Exception as e:
+                util.print_to_stderr("Error saving {0} items to table {1}: {2}".format(len(items), table, e))
+
+                with self._buffer_lock:
+                    if self._error is None:
+                        self._error = e
+
+
+    def _run_writer(self):
+        """
+            Background writer, saving batches as they come and the pending
+            items when nothing came in the last flush_interval seconds.
+        """
+        while True:
+            try:
+                operations = self._queue.get(timeout=self.flush_interval)
+
+            except queue.Empty:
+                self._write(self._take_pending())
+                continue
+
+            if operations is None:
+                self._queue.task_done()
+                return
+
+            self._write(operations)
+            self._queue.task_done()
+
+
+    def _take_pending(self):
+        """
+            Return the pending operations, emptying the buffer.
+        """
+        with self._buffer_lock:
+            operations, self._pending = self._pending, []
+
+        return operations
+
+
+    def _buffer(self, operation, table, items, snapshot=None):
+        """
+            Add items to the write buffer, handing a batch to the background
+            writer when it is full.
+        """
+        operations = [(operation, table, snapshot, item) for item in items]
+
+        if self.batch_size <= 1:
+            self._write(operations)
+            return
+
+        with self._buffer_lock:
+            self._pending.extend(operations)
+
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="amigo-db-writer")
+                self._writer.daemon = True
+                self._writer.start()
+
+            if len(self._pending) < self.batch_size:
+                return
+
+            operations, self._pending = self._pending, []
+
+        # Blocks only when the writer is a few batches behind.
+        self._queue.put(operations)
+
+
+    def flush(self):
+        """
+            Save every buffered item in the database. Raise the first error
+            saving items since the last flush.
+        """
+        operations = self._take_pending()
+
+        if self._writer is not None:
+            self._queue.put(operations)
+            self._queue.join()
+
+        elif operations:
+            self._write(operations)
+
+        with self._buffer_lock:
+            error, self._error = self._error, None
+
+        if error is not None:
+            raise error
+
+
+    def close(self):
+        """
+            Save every buffered item, stop the background writer and close
+            the engine. Raise the first error saving items, if any.
+        """
+        try:
+            self.flush()
+
+        finally:
+            with self._buffer_lock:
+                writer, self._writer = self._writer, None
+
+            if writer is not None:
+                self._queue.put(None)
+                writer.join()
+
+            with self._engine_lock:
+                self.database.close()
+
+
+    def get_table(self, table):
+        """
+            Return the items from a given table in the database.
+        """
+        self.flush()
+
+        with self._engine_lock:
+            return self.database.get_table(table)
+
+
+    def get_item(self, table, key):
+        """
+            Return the items of a given table identified by a key
+            (e.g. a projectId).
+        """
+        self.flush()
+
+        with self._engine_lock:
+            return self.database.get_item(table, key)
+
+
     def get_database(self):
         """
             Return the entire database as a dictionary.
         """
-        return self.database.all()
+        return self.get_table(DEFAULT_TABLE)
 
 
     def insert(self, table, item):
         """
             Insert an item in a given table.
         """
-        self.database.table(table).insert(item)
+        self._buffer("insert", table, [item])
+
+
+    def insert_many(self, table, items):
+        """
+            Insert a list of items in a given table at once.
+        """
+        self._buffer("insert", table, items)
+
+
+    def upsert(self, table, item, snapshot):
+        """
+            Insert an item in a snapshot (e.g. a run) of a given table,
+            replacing the item with the same key (e.g. projectId).
+        """
+        self._buffer("upsert", table, [item], snapshot)
+
+
+    def upsert_many(self, table, items, snapshot):
+        """
+            Upsert a list of items in a snapshot of a given table at once.
+        """
+        self._buffer("upsert", table, items, snapshot)
+
+
+    def get_snapshots(self, table):
+        """
+            Return the sorted list of snapshots saved for a given table.
+        """
+        self.flush()
+
+        with self._engine_lock:
+            return self.database.get_snapshots(table)
+
+
+    def get_latest_snapshot(self, table):
+        """
+            Return the most recent snapshot of a given table, or None.
+        """
+        snapshots = self.get_snapshots(table)
+
+        return snapshots[-1] if snapshots else None
+
+
+    def get_snapshot(self, table, snapshot=None):
+        """
+            Return the items of a given table in a snapshot, or in the
+            latest snapshot if none is given.
+        """
+        snapshot = snapshot or self.get_latest_snapshot(table)
+
+        if snapshot is None:
+            return []
+
+        self.flush()
+
+        with self._engine_lock:
+            return self.database.get_snapshot(table, snapshot)
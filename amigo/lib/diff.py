@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   diff.py
+#
+#   Structural diff between two lists of GCP resources. Resources are
+#   matched by a stable key (id, selfLink or name) instead of their
+#   position in the list, so the diff takes linear time and returns the
+#   added, removed and changed resources directly.
+#
+
+import json
+
+
+# Keys that identify a resource, in order of preference.
+IDENTITY_KEYS = ["id", "selfLink", "name"]
+
+
+def get_resource_key(item):
+    """
+        Return the stable key of a resource, or None if it has none.
+    """
+    if isinstance(item, dict):
+        for key in IDENTITY_KEYS:
+            if key in item:
+                return "{0}:{1}".format(key, item[key])
+
+    return None
+
+
+def get_match_key(item):
+    """
+        Return the key used to match a resource between two lists. Resources
+        without an identity key are matched by their whole content.
+    """
+    return get_resource_key(item) or json.dumps(item, sort_keys=True)
+
+
+def _get_path(path, key):
+    """
+        Return the path of a key (or list index) inside a resource.
+    """
+    if isinstance(key, int):
+        return "{0}[{1}]".format(path, key)
+
+    return "{0}.{1}".format(path, key) if path else key
+
+
+def diff_values(old, new, path=""):
+    """
+        Return a list of {"path", "old", "new"} records with every difference
+        between two values of a resource.
+    """
+    if old == new:
+        return []
+
+    changes = []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new)):
+            changes.extend(diff_values(old.get(key), new.get(key), _get_path(path, key)))
+
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new) and \
+            all(isinstance(item, dict) for item in old + new):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            changes.extend(diff_values(old_item, new_item, _get_path(path, index)))
+
+    else:
+        changes.append({"path": path, "old": old, "new": new})
+
+    return changes
+
+
+def diff_resources(old_items, new_items):
+    """
+        Compare two lists of resources, matching them by key, and return a
+        dictionary with the "added" and "removed" resources and the "changed"
+        ones (with their key and the list of changes). Every list is empty
+        if there are no differences.
+    """
+    old_keys = []
+    old_index = {}
+    for item in old_items:
+        key = get_match_key(item)
+        if key not in old_index:
+            old_keys.append(key)
+        old_index[key] = item
+
+    added = []
+    changed = []
+    seen = set()
+
+    for item in new_items:
+        key = get_match_key(item)
+        seen.add(key)
+
+        if key not in old_index:
+            added.append(item)
+            continue
+
+        changes = diff_values(old_index[key], item)
+        if changes:
+            changed.append({"key": key, "changes": changes})
+
+    removed = [old_index[key] for key in old_keys if key not in seen]
+
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def has_diff(diff):
+    """
+        Return True if a diff returned by diff_resources has any difference.
+    """
+    return bool(diff["added"] or diff["removed"] or diff["changed"])
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   discovery_cache.py
+#
+#   Persistent cache for the GCP API discovery documents, so services
+#   can be built from disk (and fully offline) instead of fetching and
+#   parsing the discovery spec every time.
+#
+
+import os
+import json
+import time
+import util
+import httplib2
+import threading
+from googleapiclient import discovery
+
+
+class DiscoveryCache():
+
+    def __init__(self, cache_dir, ttl=86400, offline=False):
+
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+
+        # Documents already loaded in this run, keyed by (api, version).
+        self.documents = {}
+
+        self._lock = threading.Lock()
+
+        util.create_dir(self.cache_dir)
+
+
+    def _get_cache_file(self, api, version):
+        """
+            Return the path of the cached document for an API and version.
+        """
+        return util.get_full_path(self.cache_dir, api + "@" + version + ".json")
+
+
+    def _is_fresh(self, cache_file):
+        """
+            Return True if the cached document is younger than the TTL.
+        """
+        return time.time() - os.path.getmtime(cache_file) < self.ttl
+
+
+    def _fetch_document(self, api, version):
+        """
+            Retrieve the discovery document from the discovery endpoint,
+            returning its content as a string, or None if it fails.
+        """
+        for uri in (discovery.DISCOVERY_URI, discovery.V2_DISCOVERY_URI):
+
+            try:
+                response, content = httplib2.Http(timeout=60).request(uri.format(api=api, apiVersion=version))
+
+            except (httplib2.HttpLib2Error, IOError) as e:
+                util.print_to_stdout("Could not fetch discovery document for {0} {1}: {2}".format(api, version, e), color="red")
+                return None
+
+            if response.status < 400:
+                return content if isinstance(content, str) else content.decode("utf-8")
+
+        util.print_to_stdout("Discovery document for {0} {1} not found.".format(api, version), color="red")
+        return None
+
+
+    def _save_document(self, cache_file, document):
+        """
+            Save the document to the cache, renaming a temporary file so that
+            concurrent runs never read a partial document.
+        """
+        tmp_file = "{0}.{1}.tmp".format(cache_file, os.getpid())
+
+        try:
+            with open(tmp_file, "w") as f:
+                f.write(document)
+
+        except IOError as e:
+            util.print_to_stderr("Error saving to {0}: {1}".format(tmp_file, e))
+            return False
+
+        return util.rename_file(tmp_file, cache_file)
+
+
+    def _read_document(self, cache_file):
+        """
+            Read a cached document from disk, returning None if it cannot be
+            read or is not valid JSON (e.g. a truncated file).
+        """
+        try:
+            with open(cache_file, "r") as f:
+                document = f.read()
+
+            json.loads(document)
+            return document
+
+        except IOError as e:
+            util.print_to_stderr("Error reading from {0}: {1}".format(cache_file, e))
+
+        except ValueError as e:
+            util.print_to_stderr("Corrupt discovery document {0}: {1}".format(cache_file, e))
+
+
+    def get_document(self, api, version):
+        """
+            Return the discovery document for an API and version as a string.
+            Fresh cached documents are used as they are. Stale ones are
+            refreshed, but still used if the endpoint cannot be reached.
+            Corrupt ones are fetched again. In offline mode the endpoint is
+            never contacted.
+        """
+        with self._lock:
+
+            if (api, version) in self.documents:
+                return self.documents[(api, version)]
+
+            cache_file = self._get_cache_file(api, version)
+            is_cached = util.is_file(cache_file)
+            is_fresh = is_cached and (self.offline or self._is_fresh(cache_file))
+            document = None
+
+            if is_fresh:
+                document = self._read_document(cache_file)
+
+            if not document and not self.offline:
+                document = self._fetch_document(api, version)
+
+                if document:
+                    self._save_document(cache_file, document)
+
+                elif is_cached and not is_fresh:
+                    util.print_to_stdout("Using stale discovery document {0}.".format(cache_file), color="yellow")
+                    document = self._read_document(cache_file)
+
+            if not document:
+                util.print_to_stderr("No discovery document available for {0} {1}.".format(api, version))
+                return None
+
+            self.documents[(api, version)] = document
+
+            return document
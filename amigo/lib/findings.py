@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   findings.py
+#
+#   Persistent store of the findings (violations and warnings) of every
+#   run, keyed by a stable fingerprint. Each run only emits the findings
+#   that are new or were resolved since the previous run, instead of every
+#   finding again. Events (diffs and changes in the number of resources)
+#   happen once, so they are always emitted and never tracked.
+#
+
+import json
+import util
+import sqlite3
+from diff import get_match_key
+
+
+def is_violation(result):
+    """
+        Return True if a result is a violation of a custom rule.
+    """
+    violation = result.get("violation")
+
+    return isinstance(violation, dict) and "rule" in violation
+
+
+def is_event(result):
+    """
+        Return True if a result is an event of a run (e.g. a diff), rather
+        than a finding that stays open until it is resolved.
+    """
+    return not is_violation(result) and "warnings" not in result
+
+
+def get_fingerprint(result):
+    """
+        Return the stable fingerprint of a result. A violation is identified
+        by its rule, project, resource and the key of the violating item, so
+        it keeps its fingerprint while the item changes. Any other result is
+        identified by its content.
+    """
+    violation = result.get("violation")
+
+    if is_violation(result):
+        return util.get_content_hash(["violation", violation["rule"], result.get("project"),
+                                      result.get("resource"), get_match_key(violation.get("resource_data"))])
+
+    return util.get_content_hash(dict((key, value) for key, value in result.items() if key != "gcp_full_report"))
+
+
+class FindingsStore():
+
+    def __init__(self, db_path):
+
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS findings "
+                                    "(fingerprint TEXT PRIMARY KEY, status TEXT NOT NULL, first_seen TEXT NOT NULL, "
+                                    "last_seen TEXT NOT NULL, resolved TEXT, data TEXT NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS findings_status ON findings (status)")
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """
+            Close the store.
+        """
+        self.connection.close()
+
+
+    def get_open(self):
+        """
+            Return the set of fingerprints of the open findings.
+        """
+        return set(fingerprint for fingerprint, in
+                   self.connection.execute("SELECT fingerprint FROM findings WHERE status = 'open'"))
+
+
+    def update(self, results, run_id, analyzed_keys=None):
+        """
+            Record the results of a run, returning a (new, resolved, still open,
+            events) tuple of lists of results. Every finding has its fingerprint
+            and its status ("new", "resolved" or "open"). Open findings missing
+            from the results are resolved. A finding seen again after being
+            resolved is new again. Events are passed through as they are.
+
+            If analyzed_keys, the set of (project, resource) keys of the reports
+            analyzed in this run, is given, a missing violation is only resolved
+            if its report was analyzed. Otherwise (e.g. the fetch of the report
+            failed) it is still open.
+        """
+        open_fingerprints = self.get_open()
+
+        new = []
+        still_open = []
+        events = []
+        seen = set()
+
+        for result in results:
+            if is_event(result):
+                events.append(result)
+                continue
+
+            fingerprint = get_fingerprint(result)
+
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+
+            if fingerprint in open_fingerprints:
+                still_open.append(dict(result, fingerprint=fingerprint, finding_status="open"))
+            else:
+                new.append(dict(result, fingerprint=fingerprint, finding_status="new"))
+
+        resolved_fingerprints = set()
+        resolved = []
+        unchecked = []
+
+        for fingerprint in sorted(open_fingerprints - seen):
+            data, = self.connection.execute("SELECT data FROM findings WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            finding = json.loads(data)
+
+            if analyzed_keys is not None and is_violation(finding) and \
+                    (finding.get("project"), finding.get("resource")) not in analyzed_keys:
+                unchecked.append(dict(finding, finding_status="open"))
+            else:
+                resolved_fingerprints.add(fingerprint)
+                resolved.append(dict(finding, finding_status="resolved"))
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO findings "
+                                        "(fingerprint, status, first_seen, last_seen, resolved, data) "
+                                        "VALUES (?, 'open', ?, ?, NULL, ?)",
+                                        ((finding["fingerprint"], run_id, run_id, self._dumps(finding)) for finding in new))
+
+            self.connection.executemany("UPDATE findings SET last_seen = ? WHERE fingerprint = ?",
+                                        ((run_id, finding["fingerprint"]) for finding in still_open))
+
+            self.connection.executemany("UPDATE findings SET status = 'resolved', resolved = ? WHERE fingerprint = ?",
+                                        ((run_id, fingerprint) for fingerprint in resolved_fingerprints))
+
+        return new, resolved, still_open + unchecked, events
+
+
+    def _dumps(self, finding):
+        """
+            Return the JSON of a finding to be stored, without the full report.
+        """
+        return json.dumps(dict((key, value) for key, value in finding.items() if key != "gcp_full_report"), sort_keys=True)
@@ -7,99 +7,195 @@
 #
 
 import util
+import threading
+from discovery_cache import DiscoveryCache
+from ratelimit import RateLimiter, RetryBudget, is_retryable
 from oauth2client.file import Storage
 from oauth2client.client import GoogleCredentials, ApplicationDefaultCredentialsError
 from googleapiclient import discovery, errors
 
 
-class GCPWrapper():
+# Fields always kept in partial responses, so resources can still be told apart.
+IDENTITY_FIELDS = ["id", "name", "selfLink"]
+
+
+def get_fields_mask(fields):
+    """
+        Given a list of resource fields, return the partial response mask
+        for a list call (e.g. "items(id,name,selfLink,allowed),nextPageToken").
+    """
+    mask_fields = IDENTITY_FIELDS + sorted(set(fields) - set(IDENTITY_FIELDS))
+
+    return "items({0}),nextPageToken".format(",".join(mask_fields))
+
+
+class GCPClientRegistry():
 
-    def __init__(self, config, entity, version):
+    def __init__(self, config):
 
         self.config = config
-        self.entity = entity
-        self.version = version
 
-        self.service = self._get_gcp_service()
+        self.auth = None
+        self.credentials = None
+        self._auth_done = False
 
-        self.warnings = []
+        self.discovery_cache = DiscoveryCache(config.get("discovery_cache_dir", ".discovery_cache"),
+                                              ttl=config.get("discovery_cache_ttl", 86400),
+                                              offline=config.get("discovery_offline", False))
+
+        # Rate limiters are shared by every thread, one per API (quota group).
+        self.limiters = {}
+        self.retry_budget = RetryBudget(config.get("retry_budget", 1000))
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
 
 
     def _auth(self):
         """
             Authenticate Amigo on GCP, fetching the credentials and saving it to
-            a local file that can be used for the service discovery.
+            a local file that can be used for the service discovery. This is only
+            done once per run, however many services are built.
         """
 
-        # Set the credentials to be used by amigo
-        local_cred_file = util.get_value(self.config, "local_cred_file")
+        with self._lock:
 
-        try:
-            self.auth = Storage(local_cred_file)
-            if util.is_file(util.get_value(self.config, "key_file")):
-                creds = GoogleCredentials.get_application_default()
-                self.auth.put(creds)
-                return True
+            if self._auth_done:
+                return self.credentials is not None
+
+            self._auth_done = True
+
+            # Set the credentials to be used by amigo
+            local_cred_file = util.get_value(self.config, "local_cred_file")
 
-        except IOError:
-            util.print_to_stderr("Cannot open {0} to write, ensure you are running as root. ".format(local_cred_file))
+            try:
+                self.auth = Storage(local_cred_file)
+                if util.is_file(util.get_value(self.config, "key_file")):
+                    creds = GoogleCredentials.get_application_default()
+                    self.auth.put(creds)
+                    self.credentials = self.auth.get()
+                    return True
 
-        except ApplicationDefaultCredentialsError:
-            util.print_to_stderr("Cannot authenticate to GCP.")
+            except IOError:
+                util.print_to_stderr("Cannot open {0} to write, ensure you are running as root. ".format(local_cred_file))
 
-        return False
+            except ApplicationDefaultCredentialsError:
+                util.print_to_stderr("Cannot authenticate to GCP.")
 
+            return False
 
-    def _get_gcp_service(self):
+
+    def get_service(self, entity, version):
         """
-            Start GCP API service.
+            Return the GCP API service for a given entity and version. Services
+            are not thread-safe, so each thread builds its own service once and
+            reuses it for the rest of the run. Services are built from the
+            cached discovery document, so no discovery request is needed.
         """
-        if self._auth():
-            return discovery.build(self.entity, self.version, credentials=self.auth.get(), cache_discovery=False)
+        services = self._local.__dict__.setdefault("services", {})
+
+        if (entity, version) not in services:
+
+            if not self._auth():
+                util.print_to_stderr("Could not start GCP API service. Exiting...")
+                return None
 
-        util.print_to_stderr("Could not start GCP API service. Exiting...")
+            document = self.discovery_cache.get_document(entity, version)
+            if not document:
+                return None
 
+            services[(entity, version)] = discovery.build_from_document(document, credentials=self.credentials)
 
-    def fetch_attribute(self, attribute, project=None):
+        return services[(entity, version)]
+
+
+    def get_limiter(self, entity):
         """
-            Fetch a given attribute for the organization. These attributes are
-            activated in the config file, e.g. networks, firewalls, etc.
+            Return the rate limiter shared by all requests to a given API. Its
+            settings come from rate_limits in the config file, where "default"
+            applies to every API without its own entry.
         """
+        with self._lock:
 
-        api = util.get_method_attribute(self.service, attribute)
+            if entity not in self.limiters:
+                rate_limits = self.config.get("rate_limits") or {}
 
-        try:
+                settings = dict(rate_limits.get("default") or {})
+                settings.update(rate_limits.get(entity) or {})
 
-            if project:
-                request = api.list(project=project)
+                self.limiters[entity] = RateLimiter(entity, max_concurrency=self.config.get("fetch_workers", 1),
+                                                    max_retries=self.config.get("max_retries", 5),
+                                                    retry_budget=self.retry_budget, **settings)
 
-            else:
-                request = api.list()
+            return self.limiters[entity]
 
-        except AttributeError:
-            util.print_to_stderr("Could not retrieve data from GCP. Check authentication.")
 
+class GCPWrapper():
+
+    def __init__(self, config, entity, version, registry=None):
+
+        self.config = config
+        self.entity = entity
+        self.version = version
+
+        # Share authentication and services with other wrappers when a
+        # registry is given.
+        self.registry = registry or GCPClientRegistry(config)
+        self.service = self.registry.get_service(entity, version)
+        self.limiter = self.registry.get_limiter(entity)
+
+        self.warnings = []
+
+
+    def _add_warning(self, attribute, error):
+        """
+            Log an error returned by GCP and add it to the warnings list.
+        """
+        err = str(error).strip("><")
+        util.print_to_stdout("Error while requesting {0}: {1}".format(attribute, err), color="red")
+        self.warnings.append(err)
+
+
+    def _get_list_params(self, fields=None, max_results=None):
+        """
+            Return the optional parameters of a list call.
+        """
+        params = {}
+
+        if fields:
+            params["fields"] = get_fields_mask(fields)
+        if max_results:
+            params["maxResults"] = max_results
+
+        return params
 
-        attribute_list = []
 
+    def _iter_pages(self, api, attribute, request, response=None):
+        """
+            Yield the items of every page of a list request. If the response
+            for the first page was already retrieved, it is used instead of
+            executing the request again.
+        """
         try:
             while request:
 
-                response = request.execute()
+                if response is None:
+                    response = self.limiter.execute(request)
 
                 # Projects are not really attributes,
                 # but they are fetched in the same way.
                 if attribute == "projects":
                     for item in response[attribute]:
                         if item["lifecycleState"] != "DELETE_REQUESTED":
-                            attribute_list.append(item)
+                            yield item
 
                 else:
                     for item in response["items"]:
-                        attribute_list.append(item)
+                        yield item
 
                 try:
                     request = api.list_next(previous_request=request, previous_response=response)
+                    response = None
 
                 except AttributeError:
                     # It starts lopping inside the items, so stop.
@@ -107,12 +203,110 @@ class GCPWrapper():
 
         except errors.HttpError as e:
             # Sometimes the response returns some error, so log it and add to the warnings list.
-            err = str(e).strip("><")
-            util.print_to_stdout("Error while requesting {0}: {1}".format(attribute, err), color="red")
-            self.warnings.append(err)
+            self._add_warning(attribute, e)
 
         except KeyError as err:
             # If it starts looping inside undesired objects.
             pass
 
-        return attribute_list
+
+    def iter_attribute(self, attribute, project=None, fields=None, max_results=None):
+        """
+            Fetch a given attribute for the organization, yielding its items
+            page by page, so they never need to be in memory at once. These
+            attributes are activated in the config file, e.g. networks,
+            firewalls, etc. If a list of fields is given, only these fields
+            are requested (partial response), and max_results sets the page size.
+        """
+
+        api = util.get_method_attribute(self.service, attribute)
+        params = self._get_list_params(fields, max_results)
+
+        try:
+
+            if project:
+                request = api.list(project=project, **params)
+
+            else:
+                request = api.list(**params)
+
+        except AttributeError:
+            util.print_to_stderr("Could not retrieve data from GCP. Check authentication.")
+            return
+
+        for item in self._iter_pages(api, attribute, request):
+            yield item
+
+
+    def iter_attribute_batch(self, attribute, projects, fields=None, max_results=None, batch_size=100):
+        """
+            Fetch a given attribute for many projects, sending the requests for the
+            first page of up to batch_size projects in a single HTTP batch request.
+            Yield a (project, items) tuple for every project that answered, where
+            items goes through the first page and fetches any following page with
+            list_next. Errors of single projects are added to the warnings.
+        """
+
+        api = util.get_method_attribute(self.service, attribute)
+        params = self._get_list_params(fields, max_results)
+
+        for start in range(0, len(projects), batch_size):
+            batch_projects = projects[start:start + batch_size]
+
+            requests = {}
+            responses = {}
+            throttled = []
+
+            def _callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif isinstance(exception, errors.HttpError) and is_retryable(exception):
+                    throttled.append(request_id)
+                else:
+                    self._add_warning(attribute, exception)
+
+            try:
+                batch = self.service.new_batch_http_request(callback=_callback)
+
+                for project in batch_projects:
+                    requests[project] = api.list(project=project, **params)
+                    batch.add(requests[project], request_id=project)
+
+                # The batch takes a token and a slot, but it is not retried as a
+                # whole: that would fire the callbacks again. Throttled projects
+                # are retried on their own below.
+                self.limiter.acquire()
+
+                try:
+                    batch.execute()
+
+                finally:
+                    self.limiter.release(throttled=bool(throttled))
+
+            except AttributeError:
+                util.print_to_stderr("Could not retrieve data from GCP. Check authentication.")
+                return
+
+            except errors.HttpError as e:
+                self._add_warning(attribute, e)
+                continue
+
+            # Throttled projects are retried with backoff.
+            for project in throttled:
+                try:
+                    responses[project] = self.limiter.execute(requests[project])
+
+                except errors.HttpError as e:
+                    self._add_warning(attribute, e)
+
+            for project in batch_projects:
+                if project in responses:
+                    yield project, self._iter_pages(api, attribute, requests[project], responses[project])
+
+
+    def fetch_attribute(self, attribute, project=None, fields=None, max_results=None):
+        """
+            Fetch a given attribute for the organization, returning all
+            of its items in a list.
+        """
+        return list(self.iter_attribute(attribute, project=project, fields=fields, max_results=max_results))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   manifest.py
+#
+#   Manifest of a reports directory. It indexes every report by its
+#   (project, attribute) and keeps the content hash of each resource
+#   and a root hash over all of them (Merkle-style), so that reports
+#   can be paired and compared without globbing or loading them, and a
+#   diff can be narrowed to the resources that changed.
+#
+
+import os
+import util
+import threading
+from catalog import CATALOG_FILE
+from blobstore import BlobStore, BLOBS_DIR
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def get_root_hash(item_hashes):
+    """
+        Return the hash of a report given the hash of each of its items,
+        regardless of their order. Every item counts, even items with the
+        same key (or duplicate items without one).
+    """
+    return util.get_content_hash(sorted(item_hashes))
+
+
+class ReportManifest():
+
+    def __init__(self, reports_path):
+
+        self.reports_path = reports_path
+        self.manifest_file = util.get_full_path(reports_path, MANIFEST_FILE) if reports_path else None
+
+        # Store of the reports saved as blobs, shared by every run in the same directory.
+        self.blob_store = BlobStore(os.path.join(os.path.dirname(reports_path), BLOBS_DIR)) if reports_path else None
+
+        # Entries keyed by (project, attribute).
+        self.index = {}
+
+        self._lock = threading.Lock()
+
+        if self.manifest_file and util.is_file(self.manifest_file):
+            self._load()
+
+        elif reports_path and util.is_path(reports_path):
+            self._load_from_directory()
+
+
+    def _load(self):
+        """
+            Load the manifest file into the index.
+        """
+        for entry in util.read_json_file(self.manifest_file) or []:
+            self.index[(entry["project"], entry["attribute"])] = entry
+
+
+    def _load_from_directory(self):
+        """
+            Index the reports of a directory without a manifest (saved by older
+            runs). These entries have no hashes, so they are always diffed.
+            The oldest runs saved reports as ".json" files, with one JSON
+            object per line, so they are read as JSON Lines too.
+        """
+        report_paths = util.list_files_in_dir(self.reports_path, "*.jsonl*") + util.list_files_in_dir(self.reports_path, "*.json")
+
+        for report_path in report_paths:
+            report_file = util.get_basename_file(report_path)
+
+            if report_path.endswith(".tmp") or report_file in (MANIFEST_FILE, CATALOG_FILE):
+                continue
+
+            resource_info = util.extract_resource_info(report_file)
+
+            # Other files (e.g. saved by hand) are not reports.
+            if resource_info is None:
+                continue
+
+            project, attribute = resource_info
+            self.index[(project, attribute)] = {"project": project, "attribute": attribute, "report": report_file}
+
+
+    def add(self, project, attribute, report_file, resource_hashes, item_hashes, **markers):
+        """
+            Add a report to the manifest, given a dictionary with the hash
+            of every resource keyed by the resource key, and the list of the
+            hashes of every item. Markers (e.g. the change marker of the
+            report) are saved in the entry too.
+        """
+        entry = dict(markers)
+        entry.update({
+                       "project": project,
+                       "attribute": attribute,
+                       "report": report_file,
+                       "count": len(item_hashes),
+                       "hash": get_root_hash(item_hashes),
+                       "resources": resource_hashes
+                     })
+
+        self.add_entry(entry)
+
+
+    def add_entry(self, entry):
+        """
+            Add an entry (e.g. of another manifest) to the manifest.
+        """
+        with self._lock:
+            self.index[(entry["project"], entry["attribute"])] = entry
+
+
+    def get(self, project, attribute):
+        """
+            Return the entry of a report, or None if it is not in the manifest.
+        """
+        return self.index.get((project, attribute))
+
+
+    def get_report_path(self, project, attribute):
+        """
+            Return the path of the report of a project attribute (in the
+            blob store if the entry points to a blob), or None.
+        """
+        entry = self.get(project, attribute)
+
+        if not entry:
+            return None
+
+        if entry.get("blob"):
+            return self.blob_store.get_path(entry["blob"])
+
+        return util.get_full_path(self.reports_path, entry["report"])
+
+
+    def keys(self):
+        """
+            Return the set of (project, attribute) in the manifest.
+        """
+        return set(self.index)
+
+
+    def save(self):
+        """
+            Save the manifest in the reports directory. The file is replaced
+            at once, so a partial manifest is never read.
+        """
+        with self._lock:
+            entries = [self.index[key] for key in sorted(self.index)]
+
+            return util.save_to_json_file(entries, self.manifest_file, atomic=True)
+
+
+def get_changed_resources(entry, previous_entry):
+    """
+        Given the manifest entries of a report and of its previous version,
+        return the set of keys of resources that were added, removed or
+        changed (an empty set if the reports are the same), or None if any
+        of the entries is missing or has no hashes.
+    """
+    if not entry or not previous_entry or "hash" not in entry or "hash" not in previous_entry:
+        return None
+
+    if entry["hash"] == previous_entry["hash"]:
+        return set()
+
+    return get_changed_keys(entry["resources"], previous_entry["resources"])
+
+
+def get_changed_keys(resources, previous_resources):
+    """
+        Given two dictionaries with the hash of every resource keyed by the
+        resource key, return the set of keys of resources that were added,
+        removed or changed.
+    """
+    return set(key for key in set(resources) | set(previous_resources)
+               if resources.get(key) != previous_resources.get(key))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   network.py
+#
+#   Interval indexes of IP ranges (CIDRs) and port ranges, used to check
+#   whether a firewall exposes a port to a network. The intervals of a rule
+#   are sorted and merged once, and every overlap query is a binary search.
+#
+
+import bisect
+import socket
+import binascii
+
+
+# Address length in bits of each IP family.
+FAMILY_BITS = {
+    socket.AF_INET: 32,
+    socket.AF_INET6: 128,
+}
+
+MAX_PORT = 65535
+
+
+def parse_cidr(cidr):
+    """
+        Return the (family, first address, last address) of a CIDR block
+        (e.g. "10.0.0.0/8" or "2600:1900::/28"), with the addresses as
+        integers. Raise ValueError if it is not valid.
+    """
+    address, _, prefix = str(cidr).strip().partition("/")
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    bits = FAMILY_BITS[family]
+
+    try:
+        start = int(binascii.hexlify(socket.inet_pton(family, address)), 16)
+        prefix = int(prefix) if prefix else bits
+    except (socket.error, ValueError):
+        raise ValueError("Invalid CIDR {0}".format(cidr))
+
+    if not 0 <= prefix <= bits:
+        raise ValueError("Invalid CIDR {0}".format(cidr))
+
+    host_mask = (1 << (bits - prefix)) - 1
+    start &= ~host_mask
+
+    return family, start, start | host_mask
+
+
+def parse_port_range(ports):
+    """
+        Return the (first port, last port) of a port or port range
+        (e.g. 22 or "8000-9000"). Raise ValueError if it is not valid.
+    """
+    first, _, last = str(ports).strip().partition("-")
+
+    try:
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        raise ValueError("Invalid port range {0}".format(ports))
+
+    if not 0 <= first <= last <= MAX_PORT:
+        raise ValueError("Invalid port range {0}".format(ports))
+
+    return first, last
+
+
+class IntervalIndex():
+    """
+        A sorted list of disjoint closed intervals, queried for overlap and
+        containment with a binary search.
+    """
+
+    def __init__(self, intervals=()):
+
+        self.starts = []
+        self.ends = []
+
+        for start, end in sorted(intervals):
+            # Merge overlapping and adjacent intervals.
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def overlaps(self, start, end):
+        """
+            Return True if the interval [start, end] overlaps any interval
+            of the index.
+        """
+        position = bisect.bisect_right(self.starts, end) - 1
+
+        return position >= 0 and self.ends[position] >= start
+
+
+    def contains(self, start, end):
+        """
+            Return True if the interval [start, end] is inside an interval
+            of the index.
+        """
+        position = bisect.bisect_right(self.starts, start) - 1
+
+        return position >= 0 and self.ends[position] >= end
+
+
+class NetworkIndex():
+    """
+        Interval indexes of CIDR blocks, one for each IP family.
+    """
+
+    def __init__(self, cidrs):
+
+        intervals = {}
+
+        for cidr in cidrs:
+            family, start, end = parse_cidr(cidr)
+            intervals.setdefault(family, []).append((start, end))
+
+        self.indexes = dict((family, IntervalIndex(family_intervals))
+                            for family, family_intervals in intervals.items())
+
+
+    def overlaps(self, cidr):
+        """
+            Return True if a CIDR block overlaps any block of the index.
+            CIDR blocks that are not valid never overlap.
+        """
+        try:
+            family, start, end = parse_cidr(cidr)
+        except ValueError:
+            return False
+
+        index = self.indexes.get(family)
+
+        return index is not None and index.overlaps(start, end)
+
+
+    def contains(self, cidr):
+        """
+            Return True if a CIDR block is inside the blocks of the index.
+            CIDR blocks that are not valid are never inside.
+        """
+        try:
+            family, start, end = parse_cidr(cidr)
+        except ValueError:
+            return False
+
+        index = self.indexes.get(family)
+
+        return index is not None and index.contains(start, end)
+
+
+class PortIndex(IntervalIndex):
+    """
+        Interval index of port ranges.
+    """
+
+    def __init__(self, ports):
+
+        IntervalIndex.__init__(self, [parse_port_range(port_range) for port_range in ports])
+
+
+    def overlaps_ports(self, ports):
+        """
+            Return True if any port range overlaps the index. Port ranges
+            that are not valid never overlap.
+        """
+        for port_range in ports:
+            try:
+                if self.overlaps(*parse_port_range(port_range)):
+                    return True
+            except ValueError:
+                continue
+
+        return False
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   ratelimit.py
+#
+#   Rate limiting for the GCP API requests. Every API (quota group) has
+#   a token bucket for its request rate and a concurrency limit that is
+#   adjusted with AIMD: it grows slowly while requests succeed and it is
+#   halved when GCP throttles us. Throttled requests are retried with
+#   exponential backoff and jitter, within a retry budget for the run.
+#
+
+import time
+import util
+import random
+import threading
+from googleapiclient import errors
+
+
+# HTTP status codes that are worth retrying.
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Reasons GCP gives for 403 errors caused by quota.
+RETRY_REASONS = ["rateLimitExceeded", "userRateLimitExceeded"]
+
+# Token bucket used when rate_limits in the config file is not valid.
+DEFAULT_REQUESTS_PER_SECOND = 20
+DEFAULT_BURST = 40
+
+
+def is_retryable(error):
+    """
+        Return True if a HttpError was caused by throttling or by a
+        transient server error.
+    """
+    status = int(getattr(error.resp, "status", 0))
+
+    if status in RETRY_STATUSES:
+        return True
+
+    content = error.content or ""
+    if not isinstance(content, str):
+        content = content.decode("utf-8", "replace")
+
+    return status == 403 and any(reason in content for reason in RETRY_REASONS)
+
+
+class RetryBudget():
+
+    def __init__(self, retries):
+
+        self.retries = retries
+
+        self._lock = threading.Lock()
+
+
+    def withdraw(self):
+        """
+            Take one retry from the budget, returning False if it is over.
+        """
+        with self._lock:
+            if self.retries <= 0:
+                return False
+
+            self.retries -= 1
+            return True
+
+
+class RateLimiter():
+
+    def __init__(self, name, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST, max_concurrency=1,
+                 max_retries=5, backoff_base=1, backoff_max=60, retry_budget=None):
+
+        self.name = name
+
+        # Token bucket. Requests would never get a token with a rate of 0
+        # or a burst under 1.
+        if not requests_per_second > 0:
+            util.print_to_stderr("Rate limit of {0} is not valid ({1} requests per second), using {2}.".format(name, \
+                                 requests_per_second, DEFAULT_REQUESTS_PER_SECOND))
+            requests_per_second = DEFAULT_REQUESTS_PER_SECOND
+
+        if not burst >= 1:
+            util.print_to_stderr("Burst of {0} is not valid ({1}), using {2}.".format(name, burst, DEFAULT_BURST))
+            burst = DEFAULT_BURST
+
+        self.rate = float(requests_per_second)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last_refill = time.time()
+
+        # AIMD concurrency limit.
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+
+        # Retries.
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget or RetryBudget(0)
+
+        self._lock = threading.Lock()
+        self._slot = threading.Condition(self._lock)
+
+
+    def _take_token(self):
+        """
+            Take a token from the bucket, returning how long to wait
+            before trying again if there is none.
+        """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+    def acquire(self):
+        """
+            Wait for a free concurrency slot and for a token.
+        """
+        with self._slot:
+            while self.in_flight >= int(self.concurrency):
+                self._slot.wait()
+
+            self.in_flight += 1
+
+        while True:
+            with self._lock:
+                wait = self._take_token()
+
+            if not wait:
+                return
+
+            time.sleep(wait)
+
+
+    def release(self, throttled=False):
+        """
+            Free a concurrency slot, halving the concurrency limit if the
+            request was throttled, or increasing it slowly otherwise.
+        """
+        with self._slot:
+            self.in_flight -= 1
+
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency / 2)
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency)
+
+            self._slot.notify_all()
+
+
+    def _get_backoff(self, attempt):
+        """
+            Return how long to wait before a retry (exponential backoff
+            with full jitter).
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+    def execute(self, request):
+        """
+            Execute a request within the rate limit, retrying it with backoff
+            when it is throttled or fails with a transient error. The last
+            error is raised when the retries (or the retry budget) are over.
+        """
+        attempt = 0
+
+        while True:
+            self.acquire()
+
+            try:
+                response = request.execute()
+
+            except errors.HttpError as e:
+                throttled = is_retryable(e)
+                self.release(throttled=throttled)
+
+                if not throttled or attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise
+
+                backoff = self._get_backoff(attempt)
+                util.print_to_stdout("Request to {0} throttled ({1}), retrying in {2:.1f}s.".format(self.name, \
+                                     e.resp.status, backoff), color="yellow")
+                time.sleep(backoff)
+                attempt += 1
+                continue
+
+            except Exception:
+                self.release()
+                raise
+
+            self.release()
+            return response
@@ -8,10 +8,16 @@
 #   it runs the analytics methods on fetched data.
 
 
+import os
 import util
-from gcp import GCPWrapper
+import errno
+from multiprocessing.pool import ThreadPool
+from gcp import GCPWrapper, GCPClientRegistry, IDENTITY_FIELDS
 from database import Database
-
+from diff import get_match_key
+from manifest import ReportManifest, get_root_hash
+from catalog import SnapshotCatalog
+from rules import load_rules
 
 
 
@@ -20,7 +26,14 @@ class Reporter():
     def __init__(self, config):
 
         self.config = config
-        self.database_path = util.get_value(self.config, "database_json")
+
+        # The database engine is "tinydb" (saved in database_json) or "sqlite"
+        # (saved in database_sqlite).
+        self.database_engine = self.config.get("database_engine", "tinydb")
+        if self.database_engine == "sqlite":
+            self.database_path = util.get_value(self.config, "database_sqlite")
+        else:
+            self.database_path = util.get_value(self.config, "database_json")
 
         self.reports = None
         self.previous_reports = None
@@ -29,9 +42,115 @@ class Reporter():
 
         self.warnings = []
 
+        # Queue where (project, attribute) is put as soon as its report is
+        # saved, to be analyzed while the others are fetched.
+        self.report_queue = None
+
+        # Every run saves its data in the database under its own snapshot.
+        self.run_id = util.get_run_id()
+
+        # Number of concurrent (project, resource, attribute) fetches.
+        # A value of 1 keeps the original serial behavior.
+        self.fetch_workers = self.config.get("fetch_workers", 1)
+
+        # Number of projects whose first page is requested in a single HTTP
+        # batch request. A value of 0 sends one request per project.
+        self.fetch_batch_size = self.config.get("fetch_batch_size", 0)
+
+        # Fields requested for each attribute (all fields if not set).
+        self.attribute_fields = self._get_attribute_fields()
+        self.max_results = self.config.get("gcp_max_results")
+
+        # In incremental mode, reports whose change marker is the same as in
+        # the previous run are carried forward instead of fetched, unless they
+        # were last fully fetched more than full_refresh_days ago.
+        self.incremental = self.config.get("incremental", False)
+        self.full_refresh_days = self.config.get("full_refresh_days", 7)
+        self.previous_manifest = None
+        self.marker_fields = self._get_marker_fields() if self.incremental else {}
+
+        # With content_addressed_reports, reports are saved compressed in a blob
+        # store shared by every run, under their hash, and the directory of a run
+        # only has the manifest pointing to them.
+        self.content_addressed_reports = self.config.get("content_addressed_reports", False)
+
+        # Reports are compressed by report_compression ("gz", "zst" or "" for none).
+        # Blobs are always compressed, with gzip by default.
+        self.report_extension = '.jsonl' + util.get_compression_extension(self.config.get("report_compression", ""))
+        self.blob_extension = self.report_extension if self.report_extension != '.jsonl' else '.jsonl.gz'
+
         self._setup()
 
 
+    def _get_attribute_fields(self):
+        """
+            Return a dictionary with the list of fields to be requested for each
+            attribute, as set in gcp_fields in the config file. If gcp_fields_from_rules
+            is set, the fields checked by the rules are added to it.
+        """
+        attribute_fields = {}
+
+        for attribute, fields in (self.config.get("gcp_fields") or {}).items():
+            attribute_fields[attribute] = list(fields)
+
+        if self.config.get("gcp_fields_from_rules"):
+            rule_set = load_rules("./rules.yaml")
+
+            for attribute in rule_set.get_resources():
+                fields = attribute_fields.setdefault(attribute, [])
+
+                for field in rule_set.get_fields(attribute):
+                    if field not in fields:
+                        fields.append(field)
+
+        return attribute_fields
+
+
+    def _get_marker_fields(self):
+        """
+            Return a dictionary with the list of fields of the change marker of
+            each attribute: creationTimestamp, the fields requested for it and
+            the fields checked by the rules, so that a change to any of them
+            (e.g. a firewall opened to more sources) changes the marker.
+        """
+        rule_set = load_rules("./rules.yaml")
+        marker_fields = {}
+
+        for attribute in set(self.attribute_fields) | set(rule_set.get_resources()):
+            fields = marker_fields.setdefault(attribute, ["creationTimestamp"])
+
+            for field in self.attribute_fields.get(attribute, []) + rule_set.get_fields(attribute):
+                if field not in fields:
+                    fields.append(field)
+
+        return marker_fields
+
+
+    def _create_reports_dir(self, output_dir):
+        """
+            Create the reports directory of this run, named after its run ID.
+            Runs started in the same second (e.g. by cron and by hand) would
+            share it, so the run ID of a later one gets a suffix (e.g. "_1"),
+            which keeps run IDs sorted in the order the runs started.
+        """
+        run_id = self.run_id
+        attempt = 0
+
+        while True:
+            reports = util.get_full_path(output_dir, self.run_id)
+
+            try:
+                os.mkdir(reports)
+                return reports
+
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            attempt += 1
+            self.run_id = "{0}_{1}".format(run_id, attempt)
+
+
     def _setup(self):
         """
             Set Amigo to run.
@@ -42,23 +161,34 @@ class Reporter():
         util.print_to_stdout("Setting up output directory at '{0}'".format(output_dir))
         util.create_dir(output_dir)
 
-        # Set current report
-        self.reports = util.get_full_path(util.get_value(self.config, "reports_dir"), util.get_date())
-        util.create_dir(self.reports)
+        # Catalog of the runs saved in the output directory
+        self.catalog = SnapshotCatalog(output_dir)
+
+        # Search for previous reports (before this run is in the catalog)
+        baseline = self.config.get("baseline", "last_successful")
+        previous_run = self.catalog.select_baseline(baseline)
+        if previous_run:
+            self.previous_reports = previous_run["reports"]
+            util.print_to_stdout("Previous report {0} found (run {1})".format(self.previous_reports, previous_run["run_id"]), color="yellow")
+        else:
+            util.print_to_stdout("No previous reports found for baseline '{0}'".format(baseline))
+
+        # Set current report, in its own directory, so that many runs a day are kept
+        self.reports = self._create_reports_dir(output_dir)
         util.print_to_stdout("Reports are being saved to '{0}'".format(self.reports))
 
-        # Search for previous reports
-        days_back = 30
-        for day in range(1, days_back):
-            self.previous_reports = util.get_full_path(util.get_value(self.config, "reports_dir"), util.get_date(day))
-            if not util.is_path(self.previous_reports):
-                util.print_to_stdout("No previous reports found at {0}'".format(self.previous_reports))
-            else:
-                util.print_to_stdout("Previous report {0} found ({1} day(s) ago)".format(self.previous_reports, day), color="yellow")
-                break
+        # Index of the reports with their content hashes, saved at the end of the run.
+        self.manifest = ReportManifest(self.reports)
+        if self.incremental:
+            self.previous_manifest = ReportManifest(self.previous_reports)
+
+        # Authenticate once and share GCP services for the whole run
+        self.gcp_clients = GCPClientRegistry(self.config)
 
         # Create Database
-        self.database = Database(self.database_path)
+        self.database = Database(self.database_path, engine=self.database_engine,
+                                 batch_size=self.config.get("database_batch_size", 1),
+                                 flush_interval=self.config.get("database_flush_interval", 5))
         util.create_dir(self.database_path)
         util.print_to_stdout("Database is being saved at '{0}'".format(self.database_path))
 
@@ -72,69 +202,328 @@ class Reporter():
 
     def _record_attribute_data_to_db(self, attribute_item, attribute_data, project_name):
         """
-            Save project attribute data to database.
+            Save project attribute data to database, item by item, passing every
+            item along so that it can also be saved to the report.
             The data in the database is used to check against custom rules.
         """
 
-        self.database.insert(attribute_item, attribute_data[0])
-        util.print_to_stdout("Data {0} for project {1} registered in the database.".format(attribute_item, project_name))
+        for item in attribute_data:
+            self.database.upsert(attribute_item, item, self.run_id)
+            yield item
+
+
+    def _hash_attribute_data(self, attribute_data, resource_hashes, item_hashes, marker_fields=None, marker_hashes=None):
+        """
+            Save the content hash of every item in resource_hashes, keyed by the
+            item key, and in item_hashes, passing the items along. If marker_fields
+            is given, the hash of every item with only these fields is saved in
+            marker_hashes, as if it had been fetched with a partial response.
+        """
+        for item in attribute_data:
+            item_hash = util.get_content_hash(item)
+            resource_hashes[get_match_key(item)] = item_hash
+            item_hashes.append(item_hash)
+
+            if marker_fields is not None:
+                marker_hashes.append(util.get_content_hash(dict((key, value) for key, value in item.items()
+                                                                if key in marker_fields)))
+            yield item
+
+
+    def _report_saved(self, project_name, attribute_item):
+        """
+            Pass a report on to be analyzed, once it is saved and in the manifest.
+        """
+        if self.report_queue is not None:
+            self.report_queue.put((project_name, attribute_item))
 
 
     def _record_attribute_data_reports(self, attribute_item, attribute_data, project_name):
         """
-            Save project attribute data to individual reports in disk.
+            Stream project attribute data to individual JSON Lines reports in disk,
+            one resource per line, returning the number of resources saved.
             These reports are used for generating a quick diff report result.
             We use the symbol "@" to be able to split on it later, when reading
-            the reports.
+            the reports. The hashes of the resources are added to the manifest,
+            with the change marker of the report in incremental mode, computed
+            from the resources themselves.
+        """
+
+        report_file = project_name + "@" + attribute_item + self.report_extension
+
+        if self.content_addressed_reports:
+            output_file = self.manifest.blob_store.get_temp_path(project_name + "@" + attribute_item, self.blob_extension)
+        else:
+            output_file = util.get_full_path(self.reports, report_file)
+
+        resource_hashes = {}
+        item_hashes = []
+        marker_fields = self._get_attribute_marker_fields(attribute_item) if self.incremental else None
+        marker_hashes = []
+        count = util.save_to_jsonl_file(self._hash_attribute_data(attribute_data, resource_hashes, item_hashes,
+                                                                  marker_fields, marker_hashes), output_file)
+
+        if count:
+            markers = {"marker": get_root_hash(marker_hashes), "refreshed": self.run_id} if self.incremental else {}
+
+            if self.content_addressed_reports:
+                markers["blob"] = get_root_hash(item_hashes) + self.blob_extension
+                output_file = self.manifest.blob_store.add_file(output_file, markers["blob"])
+
+            self.manifest.add(project_name, attribute_item, report_file, resource_hashes, item_hashes, **markers)
+            util.print_to_stdout("Resource data for {0} ({1} items) for project {2} saved to {3}".format(attribute_item, count, \
+                                 project_name, output_file), color="yellow")
+
+            self._report_saved(project_name, attribute_item)
+
+        return count
+
+
+    def _record_attribute_data(self, attribute_item, attribute_data, project_name):
+        """
+            Stream every item of a project attribute to its report and to the
+            database, without holding the whole list in memory.
+        """
+
+        items = self._record_attribute_data_to_db(attribute_item, attribute_data, project_name)
+        count = self._record_attribute_data_reports(attribute_item, items, project_name)
+
+        if count:
+            util.print_to_stdout("Data {0} for project {1} registered in the database.".format(attribute_item, project_name))
+
+        return count
+
+
+    def _get_attribute_marker_fields(self, attribute_item):
+        """
+            Return the fields of the resources of an attribute hashed in its
+            change marker: their identity fields and its marker fields.
+        """
+        return IDENTITY_FIELDS + self.marker_fields.get(attribute_item, ["creationTimestamp"])
+
+
+    def _get_change_marker(self, gcp, attribute_item, project_name):
+        """
+            Return the change marker of a project attribute: the hash of the
+            id, name, selfLink and marker fields of its resources, fetched
+            with a partial response. Return "" if it has no resources, or None
+            if the request failed.
+        """
+        number_warnings = len(gcp.warnings)
+
+        item_hashes = [util.get_content_hash(item) for item in
+                       gcp.iter_attribute(attribute_item, project=project_name,
+                                          fields=self.marker_fields.get(attribute_item, ["creationTimestamp"]),
+                                          max_results=self.max_results)]
+
+        if len(gcp.warnings) > number_warnings:
+            return None
+
+        return get_root_hash(item_hashes) if item_hashes else ""
+
+
+    def _can_carry_forward(self, attribute_item, project_name):
+        """
+            Return True if the previous report of a project attribute has a
+            change marker and was fully fetched recently, so that it can be
+            carried forward if its marker did not change.
+        """
+        previous_entry = self.previous_manifest.get(project_name, attribute_item)
+
+        if not previous_entry or not previous_entry.get("marker"):
+            return False
+
+        return previous_entry.get("refreshed", "") >= util.get_run_id(self.full_refresh_days)
+
+
+    def _carry_forward_report(self, attribute_item, project_name, marker):
         """
+            Carry the previous report of a project attribute into this run if its
+            change marker did not change. Its resources are saved in the database
+            snapshot of this run too. Return True if the report was carried forward.
+        """
+        previous_entry = self.previous_manifest.get(project_name, attribute_item)
+
+        if previous_entry.get("marker") != marker:
+            return False
 
-        output_file = util.get_full_path(self.reports, project_name + "@" + attribute_item + '.json')
+        previous_report_path = self.previous_manifest.get_report_path(project_name, attribute_item)
 
-        util.save_to_json_file(attribute_data[0], output_file)
-        util.print_to_stdout("Resource data for {0} for project {1} saved to {2}".format(attribute_item, project_name, output_file), color="yellow")
+        # Reports in the blob store are shared, so only the entry is carried forward.
+        if not previous_entry.get("blob"):
+            util.link_file(previous_report_path, util.get_full_path(self.reports, previous_entry["report"]))
+        self.manifest.add_entry(dict(previous_entry))
+
+        self.database.upsert_many(attribute_item, util.iter_jsonl_file(previous_report_path), self.run_id)
+
+        util.print_to_stdout("Resource data for {0} for project {1} did not change, carried forward from {2}".format(attribute_item, \
+                             project_name, self.previous_reports), color="yellow")
+
+        self._report_saved(project_name, attribute_item)
+
+        return True
+
+
+    def _fetch_attribute(self, gcp, attribute_item, project_name):
+        """
+            Fetch a project attribute and save it. In incremental mode, only its
+            change marker is fetched first if the previous report can be carried
+            forward. Otherwise, the marker is computed from the full fetch.
+        """
+        if self.previous_manifest is not None and self._can_carry_forward(attribute_item, project_name):
+            marker = self._get_change_marker(gcp, attribute_item, project_name)
+
+            if marker == "" or (marker and self._carry_forward_report(attribute_item, project_name, marker)):
+                return
+
+        attribute_data = gcp.iter_attribute(attribute_item, project=project_name, fields=self.attribute_fields.get(attribute_item),
+                                            max_results=self.max_results)
+        self._record_attribute_data(attribute_item, attribute_data, project_name)
 
 
     def _fetch_projects(self):
         """
             Create a GCP instance for every existing project, saving
-            the projects in the database.
+            the projects in the database snapshot of this run.
         """
 
-        gcp = GCPWrapper(self.config, "cloudresourcemanager", "v1")
+        gcp = GCPWrapper(self.config, "cloudresourcemanager", "v1", registry=self.gcp_clients)
         projects = gcp.fetch_attribute("projects")
 
         # Get any warning generated by this GCP instance.
         if gcp.warnings:
             self.warnings.extend(gcp.warnings)
 
-        for project in projects:
-            self.database.insert("projects", project)
+        self.database.upsert_many("projects", projects, self.run_id)
 
         return len(projects)
 
 
+    def _get_attribute_tasks(self):
+        """
+            Return a list with every (project, resource, attribute) triple to be
+            fetched, in the same order the serial loop would visit them.
+        """
+        gcp_attributes = self.config["gcp_attributes"]
+        tasks = []
+
+        for project in self.database.get_snapshot("projects", self.run_id):
+            project_name = util.get_value(project, "projectId")
+
+            for attribute_resource, attribute_item_list in gcp_attributes.items():
+                for attribute_item in attribute_item_list:
+                    tasks.append((project_name, attribute_resource, attribute_item))
+
+        return tasks
+
+
+    def _fetch_attribute_task(self, task):
+        """
+            Fetch a single (project, resource, attribute) triple inside a worker
+            thread, streaming it to its report and to the database. The client
+            registry hands out a service per thread.
+        """
+        project_name, attribute_resource, attribute_item = task
+
+        gcp = GCPWrapper(self.config, attribute_resource, "v1", registry=self.gcp_clients)
+        self._fetch_attribute(gcp, attribute_item, project_name)
+
+        return gcp.warnings
+
+
+    def _get_attribute_batch_tasks(self):
+        """
+            Return a list with every (projects, resource, attribute) triple to be
+            fetched in batch mode, where projects has up to fetch_batch_size
+            project names.
+        """
+        gcp_attributes = self.config["gcp_attributes"]
+        project_names = [util.get_value(project, "projectId") for project in self.database.get_snapshot("projects", self.run_id)]
+        tasks = []
+
+        for attribute_resource, attribute_item_list in gcp_attributes.items():
+            for attribute_item in attribute_item_list:
+                for start in range(0, len(project_names), self.fetch_batch_size):
+                    tasks.append((project_names[start:start + self.fetch_batch_size], attribute_resource, attribute_item))
+
+        return tasks
+
+
+    def _fetch_attribute_batch_task(self, task):
+        """
+            Fetch an attribute for a group of projects with a single HTTP batch
+            request, streaming each project to its report and to the database.
+        """
+        project_names, attribute_resource, attribute_item = task
+
+        gcp = GCPWrapper(self.config, attribute_resource, "v1", registry=self.gcp_clients)
+        batch = gcp.iter_attribute_batch(attribute_item, project_names, fields=self.attribute_fields.get(attribute_item),
+                                         max_results=self.max_results, batch_size=self.fetch_batch_size)
+
+        for project_name, attribute_data in batch:
+            self._record_attribute_data(attribute_item, attribute_data, project_name)
+
+        return gcp.warnings
+
+
+    def _fetch_attributes_concurrently(self, fetch_task, tasks):
+        """
+            Fan out the fetch tasks (e.g. every (project, resource, attribute)
+            triple) over a pool of threads. Every project attribute has its own
+            report file and the database buffer is thread-safe, while warnings
+            are collected in task order by the calling thread, so the output is
+            the same as in the serial path.
+        """
+        pool = ThreadPool(processes=self.fetch_workers)
+
+        try:
+            for warnings in pool.imap(fetch_task, tasks):
+                self.warnings.extend(warnings)
+
+        finally:
+            pool.close()
+            pool.join()
+
+        return True
+
+
     def _fetch_attributes_for_projects(self):
         """
-            Fetch attributes for each GCP project in the database, saving the
-            data in disk.
+            Fetch attributes for each GCP project in the snapshot of this run,
+            saving the data in disk.
         """
 
+        if self.previous_manifest is not None:
+            util.print_to_stdout("Fetching attributes incrementally from {0}.".format(self.previous_reports or "no previous reports"))
+
+        if self.fetch_batch_size > 0 and self.previous_manifest is None:
+            util.print_to_stdout("Fetching attributes in batches of {0} projects.".format(self.fetch_batch_size))
+            tasks = self._get_attribute_batch_tasks()
+
+            if self.fetch_workers > 1:
+                return self._fetch_attributes_concurrently(self._fetch_attribute_batch_task, tasks)
+
+            for task in tasks:
+                self.warnings.extend(self._fetch_attribute_batch_task(task))
+
+            return True
+
+        if self.fetch_workers > 1:
+            util.print_to_stdout("Fetching attributes with {0} workers.".format(self.fetch_workers))
+            return self._fetch_attributes_concurrently(self._fetch_attribute_task, self._get_attribute_tasks())
+
         gcp_attributes = self.config["gcp_attributes"]
 
-        for project in self.database.get_table("projects"):
+        for project in self.database.get_snapshot("projects", self.run_id):
             project_name = util.get_value(project, "projectId")
 
             # Gets all the resources specified in the config file (e.g. "compute")
             for attribute_resource, attribute_item_list in gcp_attributes.items():
-                gcp = GCPWrapper(self.config, attribute_resource, "v1")
+                gcp = GCPWrapper(self.config, attribute_resource, "v1", registry=self.gcp_clients)
 
                 # Loop on the attributes in of that resource (e.g. firewalls, networks, etc)
                 for attribute_item in attribute_item_list:
-
-                    attribute_data = gcp.fetch_attribute(attribute_item, project=project_name)
-                    if attribute_data:
-                        self._record_attribute_data_reports(attribute_item, attribute_data, project_name)
-                        self._record_attribute_data_to_db(attribute_item, attribute_data, project_name)
+                    self._fetch_attribute(gcp, attribute_item, project_name)
 
                 # Get any warning generated by this GCP instance.
                 if gcp.warnings:
@@ -143,17 +532,39 @@ class Reporter():
         return True
 
 
-    def run(self):
+    def run(self, report_queue=None):
         """
-            Run Amigo.
+            Run Amigo. If a queue is given, every (project, attribute) is put
+            in it as soon as its report is saved, and None at the end.
         """
 
-        # Fetch resources from GCP and save reports in disk.
-        number_projects = self._fetch_projects()
+        self.report_queue = report_queue
+        self.catalog.start_run(self.run_id, self.reports)
+
+        # Fetch resources from GCP and save reports in disk. Leaving the
+        # database context saves every buffered item.
+        try:
+            with self.database:
+                number_projects = self._fetch_projects()
+
+                self._fetch_attributes_for_projects()
 
-        self._fetch_attributes_for_projects()
+            self.manifest.save()
+
+        except Exception:
+            self.catalog.finish_run(self.run_id, "failed")
+            raise
+
+        finally:
+            if self.report_queue is not None:
+                self.report_queue.put(None)
+
+        self.catalog.finish_run(self.run_id, "success", counts={
+                                                                 "projects": number_projects,
+                                                                 "reports": len(self.manifest.keys()),
+                                                                 "warnings": len(self.warnings),
+                                                               })
 
         util.print_to_stdout("{0} projects were retrieved.".format(number_projects), color="green")
 
         return self.reports, self.previous_reports
-
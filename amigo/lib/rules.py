@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   rules.py
+#
+#   Compiles the custom rules in rules.yaml into rule objects, grouped
+#   by the resource they check (e.g. firewalls), so that every report
+#   is read once and checked against all of its rules in a single pass.
+#
+
+import re
+import util
+from network import NetworkIndex, PortIndex
+
+
+# Tokens of a key path, e.g. "allowed[*].ports" is "allowed", "*", "ports".
+PATH_TOKEN = re.compile(r"([^.\[\]]+)|\[(\*|\d+)\]")
+
+
+def compile_path(path):
+    """
+        Split a key path into a list of tokens: dictionary keys, list indexes
+        and "*" for every item of a list. Raise ValueError if it is not valid.
+    """
+    tokens = []
+    position = 0
+
+    for match in PATH_TOKEN.finditer(path):
+        if match.start() != position and path[position:match.start()] != ".":
+            raise ValueError("Invalid key path {0}".format(path))
+
+        key, index = match.groups()
+        if key is not None:
+            tokens.append(key)
+        elif index == "*":
+            tokens.append("*")
+        else:
+            tokens.append(int(index))
+
+        position = match.end()
+
+    if not tokens or position != len(path):
+        raise ValueError("Invalid key path {0}".format(path))
+
+    return tokens
+
+
+def resolve_path(data, tokens):
+    """
+        Yield every value found in the data for a compiled key path.
+    """
+    if not tokens:
+        yield data
+        return
+
+    token, tokens = tokens[0], tokens[1:]
+
+    if token == "*":
+        if isinstance(data, list):
+            for item in data:
+                for value in resolve_path(item, tokens):
+                    yield value
+
+    elif isinstance(token, int):
+        if isinstance(data, list) and -len(data) <= token < len(data):
+            for value in resolve_path(data[token], tokens):
+                yield value
+
+    elif isinstance(data, dict) and token in data:
+        for value in resolve_path(data[token], tokens):
+            yield value
+
+
+class KeyValueRule():
+    """
+        A key-value rule is simple a rule that checks whether a
+        given value is in the resources' report, given its key.
+        The key is a path (e.g. "allowed[*].ports"), and the rule is
+        violated when every key of the rule has the expected value.
+    """
+
+    def __init__(self, name, resource, items):
+
+        self.name = name
+        self.resource = resource
+        self.items = [(compile_path(key), value) for item in items for key, value in item.items()]
+
+
+    def _match_value(self, value, expected):
+        """
+            A value matches if it equals the expected value, or if it is in the
+            expected list of values. List values match if any of its items do.
+        """
+        if isinstance(value, list):
+            return any(self._match_value(item, expected) for item in value)
+
+        if isinstance(expected, list):
+            return value in expected
+
+        return value == expected
+
+
+    def get_fields(self):
+        """
+            Return the top-level fields of the resource checked by the rule.
+        """
+        return [tokens[0] for tokens, value in self.items]
+
+
+    def match(self, resource_data):
+        """
+            Return True if the resource violates the rule.
+        """
+        if not self.items:
+            return False
+
+        for tokens, expected in self.items:
+            if not any(self._match_value(value, expected) for value in resolve_path(resource_data, tokens)):
+                return False
+
+        return True
+
+
+class NetworkExposureRule():
+    """
+        A network exposure rule checks whether a firewall allows traffic
+        from any of the rule's source ranges to any of its ports. CIDRs and
+        port ranges are checked by overlap (e.g. 0.0.0.0/1 is part of the
+        internet, and 20-25 exposes port 22), not by string. Source ranges
+        inside the rule's trusted ranges (e.g. private networks) are ignored.
+    """
+
+    def __init__(self, name, resource, violation):
+
+        self.name = name
+        self.resource = resource
+
+        self.source_ranges = NetworkIndex(violation["source_ranges"])
+        self.trusted_ranges = NetworkIndex(violation.get("trusted_ranges") or [])
+
+        # Without protocols or ports the rule checks any of them.
+        self.protocols = set(str(protocol).lower() for protocol in violation.get("protocols") or [])
+        self.ports = PortIndex(violation["ports"]) if violation.get("ports") else None
+
+
+    def _match_source_range(self, cidr):
+        """
+            A source range matches if it overlaps the rule's source ranges
+            and is not inside its trusted ranges.
+        """
+        return self.source_ranges.overlaps(cidr) and not self.trusted_ranges.contains(cidr)
+
+
+    def _match_allowed(self, allowed):
+        """
+            An allowed entry matches if its protocol is one of the rule's
+            and if its ports (every port, when it has none) overlap them.
+        """
+        protocol = str(allowed.get("IPProtocol", "")).lower()
+
+        if self.protocols and protocol != "all" and protocol not in self.protocols:
+            return False
+
+        if self.ports is None or not allowed.get("ports"):
+            return True
+
+        return self.ports.overlaps_ports(allowed["ports"])
+
+
+    def get_fields(self):
+        """
+            Return the top-level fields of the firewall checked by the rule.
+        """
+        return ["direction", "disabled", "sourceRanges", "allowed"]
+
+
+    def match(self, resource_data):
+        """
+            Return True if the firewall exposes the rule's ports.
+        """
+        if resource_data.get("direction", "INGRESS") != "INGRESS" or resource_data.get("disabled"):
+            return False
+
+        if not any(self._match_source_range(cidr) for cidr in resource_data.get("sourceRanges", [])):
+            return False
+
+        return any(self._match_allowed(allowed) for allowed in resource_data.get("allowed", []))
+
+
+# Rule classes for each rule_type in rules.yaml.
+RULE_TYPES = {
+    "key_value": KeyValueRule,
+    "network_exposure": NetworkExposureRule,
+}
+
+
+class RuleSet():
+
+    def __init__(self, rules, rules_file="rules"):
+
+        # Compiled rules keyed by the resource they check.
+        self.rules = {}
+
+        if not isinstance(rules, dict):
+            util.print_to_stdout("Rule file ('{0}') is ill-formatted.".format(rules_file))
+            return
+
+        for rule_name in sorted(rules):
+            rule = rules[rule_name]
+
+            try:
+                rule_class = RULE_TYPES.get(rule["rule_type"])
+                if rule_class is None:
+                    continue
+
+                compiled_rule = rule_class(rule_name, rule["violation_resource"], rule["violation"])
+
+            except (KeyError, TypeError, AttributeError, ValueError):
+                util.print_to_stderr("Rule {0} is ill-formatted in the {1}.".format(rule_name, rules_file))
+                continue
+
+            self.rules.setdefault(compiled_rule.resource, []).append(compiled_rule)
+
+
+    def get_rules(self, resource):
+        """
+            Return the list of rules that check a given resource.
+        """
+        return self.rules.get(resource, [])
+
+
+    def get_fields(self, resource):
+        """
+            Return the top-level fields of a resource checked by its rules.
+        """
+        fields = []
+
+        for rule in self.get_rules(resource):
+            for field in rule.get_fields():
+                if field not in fields:
+                    fields.append(field)
+
+        return fields
+
+
+    def get_resources(self):
+        """
+            Return the list of resources with rules.
+        """
+        return sorted(self.rules)
+
+
+    def evaluate(self, resource_data, resource):
+        """
+            Return the list of rules violated by a resource.
+        """
+        return [rule for rule in self.get_rules(resource) if rule.match(resource_data)]
+
+
+def load_rules(rules_file):
+    """
+        Read and compile the rules of a rules file.
+    """
+    return RuleSet(util.read_yaml_file(rules_file), rules_file)
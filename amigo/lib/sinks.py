@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   sinks.py
+#
+#   Sinks where the results (findings) of a run are saved: a JSON Lines
+#   log, a JSON Lines file per run, or a SQLite database that can be
+#   queried by rule, project or resource. Results are buffered and saved
+#   at once when the sink is closed, so a run never leaves partial results.
+#
+
+import os
+import util
+import sqlite3
+from diff import get_match_key
+
+
+def get_result_fields(result):
+    """
+        Return the (rule, project, resource, resource key) of a result, if
+        it has them. Violations have the project and the resource (e.g.
+        firewalls), while diffs have the project as the resource and the
+        resource as the attribute.
+    """
+    violation = result.get("violation")
+
+    if isinstance(violation, dict):
+        resource_data = violation.get("resource_data")
+        return (violation.get("rule"), result.get("project"), result.get("resource"),
+                get_match_key(resource_data) if resource_data is not None else None)
+
+    return None, result.get("resource"), result.get("attribute"), None
+
+
+class JSONLinesSink():
+    """
+        Save the results to a JSON Lines log, one result per line. The
+        results of a run are buffered and appended to the log (with the
+        results of previous runs) in a single write when the sink is closed.
+    """
+
+    def __init__(self, filepath):
+
+        self.filepath = filepath
+        self.compression = os.path.splitext(filepath)[1].lstrip(".")
+        self.count = 0
+
+        self._pending = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+
+    def write(self, result):
+        """
+            Add a result to the sink.
+        """
+        self._pending.append(util.json_dumps(result))
+        self.count += 1
+
+
+    def _save(self):
+        """
+            Append the results to the log, flushed to disk.
+        """
+        if self._pending:
+            util.append_to_file("".join(line + "\n" for line in self._pending), self.filepath, self.compression)
+
+
+    def close(self, commit=True):
+        """
+            Save the results, or discard them if commit is not set.
+        """
+        if commit:
+            self._save()
+
+        self._pending = []
+
+
+class ShardedJSONLinesSink(JSONLinesSink):
+    """
+        Save the results of every run to their own JSON Lines file, named
+        after the log and the run ID (e.g. amigo.<run ID>.log).
+    """
+
+    def __init__(self, filepath, run_id):
+
+        name, extension = os.path.splitext(filepath)
+        JSONLinesSink.__init__(self, "{0}.{1}{2}".format(name, run_id, extension))
+
+
+    def _save(self):
+        """
+            Save the results to a temporary file that then replaces the file
+            of the run at once.
+        """
+        tmp_filepath = self.filepath + ".tmp"
+
+        with util.open_file(tmp_filepath, "w", compression=self.compression) as f:
+            for line in self._pending:
+                f.write(line)
+                f.write("\n")
+
+        os.rename(tmp_filepath, self.filepath)
+
+
+class SQLiteSink():
+    """
+        Save the results to a SQLite database, indexed by run, rule, project
+        and resource, in a single transaction when the sink is closed.
+    """
+
+    def __init__(self, db_path, run_id):
+
+        self.run_id = run_id
+        self.count = 0
+
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                    "(id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, name TEXT, "
+                                    "rule TEXT, project TEXT, resource TEXT, resource_key TEXT, data TEXT NOT NULL)")
+
+            for column in ["run_id", "rule", "project", "resource"]:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS results_{0} ON results ({0})".format(column))
+
+        self._pending = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+
+    def write(self, result):
+        """
+            Add a result to the sink.
+        """
+        rule, project, resource, resource_key = get_result_fields(result)
+
+        self._pending.append((self.run_id, result.get("name"), rule, project, resource, resource_key,
+                              util.json_dumps(result)))
+        self.count += 1
+
+
+    def close(self, commit=True):
+        """
+            Save the results, or discard them if commit is not set.
+        """
+        if commit:
+            with self.connection:
+                self.connection.executemany("INSERT INTO results "
+                                            "(run_id, name, rule, project, resource, resource_key, data) "
+                                            "VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+
+        self._pending = []
+        self.connection.close()
+
+
+def get_results_sink(config, results_path, run_id):
+    """
+        Return the sink set in results_sink in the config file: "jsonl" (the
+        results log, by default), "sharded" (a file per run next to it) or
+        "sqlite" (saved in results_sqlite, in the same directory).
+    """
+    sink = config.get("results_sink", "jsonl")
+
+    if sink == "sharded":
+        return ShardedJSONLinesSink(results_path, run_id)
+
+    if sink == "sqlite":
+        db_path = util.get_full_path(os.path.dirname(results_path), config.get("results_sqlite", "results.db"))
+        return SQLiteSink(db_path, run_id)
+
+    if sink != "jsonl":
+        util.print_to_stderr("Results sink {0} is not valid, using jsonl.".format(sink))
+
+    return JSONLinesSink(results_path)
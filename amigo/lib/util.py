@@ -7,16 +7,55 @@
 #   many classes in Amigo.
 #
 
+import io
 import os
 import sys
+import mmap
 import yaml
 import json
+import gzip
 import glob
+import shutil
+import hashlib
 import logging
 import datetime
 import jsondiff
 import termcolor
 
+# Faster JSON codecs and zstd compression are optional.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# JSON codecs by name, in order of preference, with their (dumps, loads)
+# functions. dumps returns a string without a trailing newline.
+JSON_CODECS = {
+    "orjson": (lambda data: orjson.dumps(data).decode("utf-8"), orjson.loads) if orjson else None,
+    "ujson": (lambda data: ujson.dumps(data, escape_forward_slashes=False), ujson.loads) if ujson else None,
+    "json": (json.dumps, json.loads),
+}
+JSON_CODECS_PREFERENCE = ["orjson", "ujson", "json"]
+
+# Compression of a file by the extension of its name.
+COMPRESSION_EXTENSIONS = {
+    "gz": ".gz",
+    "zst": ".zst",
+}
+
+_json_dumps, _json_loads = json.dumps, json.loads
+
 
 def print_to_stderr(msg):
     """
@@ -55,6 +94,60 @@ def get_diff_dicts(dict1, dict2):
     return jsondiff.diff(dict1, dict2, syntax="explicit", dump=True)
 
 
+def get_content_hash(data):
+    """
+        Return the SHA-256 hash of the canonical JSON form of an object,
+        which is the same for equal objects whatever their key order.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def set_json_codec(codec="auto"):
+    """
+        Set the JSON codec used to read and save every report and result:
+        "orjson", "ujson", "json" (the standard library), or "auto" for the
+        fastest one installed. Return the name of the codec in use.
+    """
+    global _json_dumps, _json_loads
+
+    if codec == "auto":
+        codec = [name for name in JSON_CODECS_PREFERENCE if JSON_CODECS[name]][0]
+
+    elif not JSON_CODECS.get(codec):
+        print_to_stderr("JSON codec {0} is not available, using json.".format(codec))
+        codec = "json"
+
+    _json_dumps, _json_loads = JSON_CODECS[codec]
+
+    return codec
+
+
+def json_dumps(data):
+    """
+        Serialize an object to a JSON string with the JSON codec in use.
+    """
+    return _json_dumps(data)
+
+
+def json_loads(string):
+    """
+        Deserialize a JSON string to an object with the JSON codec in use.
+    """
+    return _json_loads(string)
+
+
+def get_compression_extension(compression):
+    """
+        Return the extension of a file name for a compression ("gz", "zst",
+        or "" for none).
+    """
+    if compression and compression not in COMPRESSION_EXTENSIONS:
+        print_to_stderr("Compression {0} is not supported, files will not be compressed.".format(compression))
+
+    return COMPRESSION_EXTENSIONS.get(compression, "")
+
+
 def list_files_in_dir(dir_path, ext="*"):
     """
         Return a list of all files found in the directory for a given
@@ -78,6 +171,15 @@ def get_date(days_ago=0):
     return (datetime.datetime.now() - datetime.timedelta(days=days_ago)).strftime(date_format)
 
 
+def get_run_id(days_ago=0):
+    """
+        Return a string identifying a run by its start time (now, or the
+        current time minus the number of days). Run IDs sort in the same
+        order the runs happened.
+    """
+    return (datetime.datetime.now() - datetime.timedelta(days=days_ago)).strftime("%Y_%m_%d_%H_%M_%S")
+
+
 def create_dir(dir_path):
     """
         Creates a directory for a given path.
@@ -117,26 +219,179 @@ def read_yaml_file(yaml_filepath):
         print_to_stderr("Error opening {0}: {1}".format(yaml_filepath, e))
 
 
-def save_to_json_file(data_dict, filepath, mode="w", pretty=False):
+def save_to_json_file(data_dict, filepath, mode="w", pretty=False, atomic=False):
     """
-        Save a dictionary object to a JSON file.
+        Save a dictionary object to a JSON file. If atomic is set, the data is
+        saved to a temporary file that then replaces the file at once.
     """
+    save_filepath = filepath + ".tmp" if atomic else filepath
 
     try:
-        with open(filepath, mode) as f:
+        with open_file(save_filepath, mode, compression=os.path.splitext(filepath)[1].lstrip(".")) as f:
             if pretty:
                 json.dump(data_dict, f, sort_keys=True, indent=4, separators=(',', ': '))
             else:
-                json.dump(data_dict, f)
+                f.write(json_dumps(data_dict))
                 f.write("\n")
 
+        if atomic:
+            os.rename(save_filepath, filepath)
+
         return True
 
+    except (IOError, OSError) as e:
+        print_to_stderr("Error saving to {0}: {1}".format(filepath, e))
+
+    except TypeError as e:
+        print_to_stderr("Error saving to {0}: {1}".format(filepath, e))
+
+
+def open_file(filepath, mode="r", compression=None):
+    """
+        Open a text file, compressed with gzip or zstd. By default, the
+        compression is given by the extension of the file name (".gz" or
+        ".zst"), and files with other names are not compressed.
+    """
+    if compression is None:
+        compression = os.path.splitext(filepath)[1].lstrip(".")
+
+    if compression == "gz":
+        return gzip.open(filepath, mode + ("t" if sys.version_info[0] >= 3 else "b"))
+
+    if compression == "zst":
+        if zstandard is None:
+            raise IOError("zstandard is not installed, {0} cannot be opened".format(filepath))
+
+        # Files that were appended to (e.g. the results log) have a frame
+        # for every append.
+        if mode == "r":
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filepath, "rb"),
+                                                                              read_across_frames=True))
+
+        return zstandard.open(filepath, mode + "t")
+
+    return open(filepath, mode)
+
+
+def append_to_file(text, filepath, compression=None):
+    """
+        Append a string to a file in a single write, and flush it to disk.
+        Compressed files (".gz" or ".zst", by default) get a new gzip member
+        or zstd frame, which readers go through in order. Return True if the
+        string was saved.
+    """
+    if compression is None:
+        compression = os.path.splitext(filepath)[1].lstrip(".")
+
+    data = text if isinstance(text, bytes) else text.encode("utf-8")
+
+    try:
+        with open(filepath, "ab") as f:
+            if compression == "gz":
+                with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                    gz.write(data)
+
+            elif compression == "zst":
+                if zstandard is None:
+                    raise IOError("zstandard is not installed, {0} cannot be opened".format(filepath))
+
+                f.write(zstandard.ZstdCompressor().compress(data))
+
+            else:
+                f.write(data)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+    except IOError as e:
+        print_to_stderr("Error saving to {0}: {1}".format(filepath, e))
+        return False
+
+    return True
+
+
+def save_to_jsonl_file(items, filepath):
+    """
+        Save an iterable of dictionaries to a JSON Lines file, one item
+        per line, without holding them all in memory. The file is only
+        created if there is at least one item, and it is compressed if its
+        name ends with ".gz" or ".zst". Return the number of items.
+    """
+    tmp_filepath = filepath + ".tmp"
+    count = 0
+    saved = False
+
+    try:
+        with open_file(tmp_filepath, "w", compression=os.path.splitext(filepath)[1].lstrip(".")) as f:
+            for item in items:
+                f.write(json_dumps(item))
+                f.write("\n")
+                count += 1
+
+        saved = True
+
     except IOError as e:
         print_to_stderr("Error saving to {0}: {1}".format(filepath, e))
+        return 0
 
     except TypeError as e:
         print_to_stderr("Error saving to {0}: {1}".format(filepath, e))
+        return 0
+
+    finally:
+        # Never leave a partial (or empty) temporary file behind.
+        if not (saved and count) and os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+    if count:
+        os.rename(tmp_filepath, filepath)
+
+    return count
+
+
+def iter_file_lines(filepath):
+    """
+        Yield the lines of a text file, one at a time. Uncompressed files are
+        mapped in memory (mmap), so lines are read straight from the page cache
+        instead of being copied through a file buffer.
+    """
+    if os.path.splitext(filepath)[1].lstrip(".") in COMPRESSION_EXTENSIONS or not os.path.getsize(filepath):
+        with open_file(filepath, 'r') as f:
+            for line in f:
+                yield line
+        return
+
+    with open(filepath, 'rb') as f:
+        mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for line in iter(mapped_file.readline, b""):
+                yield line.decode("utf-8")
+
+        finally:
+            mapped_file.close()
+
+
+def iter_jsonl_file(jsonl_filepath):
+    """
+        Read a JSON Lines file (compressed if its name ends with ".gz" or
+        ".zst"), yielding one dictionary per line, so that only one line is
+        in memory at once.
+    """
+    try:
+        for line in iter_file_lines(jsonl_filepath):
+            if line.strip():
+                yield json_loads(line)
+
+    except (IOError, OSError) as e:
+       print_to_stderr("Error reading from {0}: {1}".format(jsonl_filepath, e))
+
+
+def read_jsonl_file(jsonl_filepath):
+    """
+        Read a JSON Lines file to a list of dictionaries.
+    """
+    return list(iter_jsonl_file(jsonl_filepath))
 
 
 def read_json_file(json_filepath):
@@ -144,8 +399,8 @@ def read_json_file(json_filepath):
         Read a JSON object to a dictionary.
     """
     try:
-        with open(json_filepath, 'r') as f:
-            return json.load(f)
+        with open_file(json_filepath, 'r') as f:
+            return json_loads(f.read())
 
     except IOError as e:
        print_to_stderr("Error reading from {0}: {1}".format(json_filepath, e))
@@ -171,6 +426,18 @@ def rename_file(file_path_old, file_path_new):
         return False
 
 
+def link_file(file_path_old, file_path_new):
+    """
+        Hard link a file to a new path, so that both share the same data in
+        disk, or copy it if it cannot be linked (e.g. other file systems).
+    """
+    try:
+        os.link(file_path_old, file_path_new)
+
+    except (OSError, AttributeError):
+        shutil.copyfile(file_path_old, file_path_new)
+
+
 def is_path(dir_path):
     """
         Return True if a path exists, or halts if False.
@@ -188,16 +455,17 @@ def get_basename_file(filename):
 def extract_resource_info(filepath):
     """
         Given a file path to a report, extract the name of the resource
-        and the attribute being reported, returning them as two strings.
-        Note that `@` was defined as the separator when the report was
-        saved in disk.
+        and the attribute being reported, returning them as two strings,
+        or None if the file name has no `@`. Note that `@` was defined as
+        the separator when the report was saved in disk.
     """
     try:
-        data = os.path.splitext(os.path.basename(filepath))[0].split("@")
-        return data[0], data[1]
+        # Attributes have no ".", so anything after it is the extension (e.g. ".jsonl.gz").
+        data = os.path.basename(filepath).split("@")
+        return data[0], data[1].split(".")[0]
 
-    except KeyError as e:
-        print_to_stderr("Error extracting resource info from {filepath}: {1}".format(json_filepath, e))
+    except IndexError as e:
+        print_to_stderr("Error extracting resource info from {0}: {1}".format(filepath, e))
 
 
 def get_full_path(dir_path, file):
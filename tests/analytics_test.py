@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   analytics_test.py
+#
+#   Test the module analytics.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import analytics
+
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rules.yaml")
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.previous_reports = os.path.join(self.tmp_dir, "2018_01_01_00_00_00")
+        self.reports = os.path.join(self.tmp_dir, "2018_01_02_00_00_00")
+
+        for number in range(6):
+            project_name = "test-{0}".format(number)
+
+            firewalls = [
+                {"id": project_name + "-1", "name": "default-allow-ssh", "sourceRanges": ["0.0.0.0/0"],
+                 "allowed": [{"IPProtocol": "tcp", "ports": ["22"]}]},
+                {"id": project_name + "-2", "name": "default-allow-icmp", "sourceRanges": ["10.0.0.0/8"],
+                 "allowed": [{"IPProtocol": "icmp"}]},
+            ]
+            networks = [{"id": project_name + "-3", "name": "default", "autoCreateSubnetworks": number % 2 == 0}]
+
+            self._save_report(self.previous_reports, project_name, "firewalls", firewalls)
+            self._save_report(self.previous_reports, project_name, "networks", networks)
+
+            # Every other project opens its ICMP firewall to the world.
+            if number % 2:
+                firewalls[1] = dict(firewalls[1], sourceRanges=["0.0.0.0/0"])
+
+            self._save_report(self.reports, project_name, "firewalls", firewalls)
+            self._save_report(self.reports, project_name, "networks", networks)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def _save_report(self, reports_path, project_name, attribute, items):
+
+        util.create_dir(reports_path)
+        util.save_to_jsonl_file(items, os.path.join(reports_path, project_name + "@" + attribute + ".jsonl"))
+
+
+    def _analyze_reports(self, workers=1, chunk_size=0):
+
+        analyzer = analytics.Analytics(self.reports, self.previous_reports, workers=workers, chunk_size=chunk_size)
+        analyzer.rules_file = RULES_FILE
+
+        return analyzer.analyze_reports()
+
+
+    def test_analyze_reports(self):
+
+        diff_results, violation_results = self._analyze_reports()
+
+        self.assertEqual([result["resource"] for result in diff_results], ["test-1", "test-3", "test-5"])
+
+        # Open SSH in every project, and auto subnetworks in every other one.
+        self.assertEqual(len(violation_results), 9)
+
+
+    def test_analyze_reports_workers(self):
+
+        results = self._analyze_reports()
+
+        for chunk_size in [1, 2]:
+            self.assertEqual(self._analyze_reports(workers=3, chunk_size=chunk_size), results)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   blobstore_test.py
+#
+#   Test the module blobstore.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import blobstore
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.blob_store = blobstore.BlobStore(os.path.join(self.tmp_dir, blobstore.BLOBS_DIR))
+        self.items = [{"id": "1111", "name": "default-allow-ssh"}]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_add_file(self):
+
+        for _ in range(2):
+            temp_path = self.blob_store.get_temp_path("test-163318@firewalls")
+            util.save_to_jsonl_file(self.items, temp_path)
+            blob_path = self.blob_store.add_file(temp_path, "abcdef")
+
+            self.assertFalse(os.path.exists(temp_path))
+
+        self.assertTrue(self.blob_store.has("abcdef"))
+        self.assertEqual(blob_path, self.blob_store.get_path("abcdef"))
+        self.assertEqual(util.read_jsonl_file(blob_path), self.items)
+        self.assertEqual(os.listdir(os.path.dirname(blob_path)), ["abcdef" + blobstore.BLOB_EXTENSION])
+
+
+    def test_get_path(self):
+
+        self.assertEqual(self.blob_store.get_path("abcdef"), self.blob_store.get_path("abcdef.jsonl.gz"))
+        self.assertTrue(self.blob_store.get_path("abcdef.jsonl.zst").endswith(os.path.join("ab", "abcdef.jsonl.zst")))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   catalog_test.py
+#
+#   Test the module catalog.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import catalog
+
+
+class TestSnapshotCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.catalog = catalog.SnapshotCatalog(self.tmp_dir)
+
+        self.yesterday = util.get_run_id(days_ago=1)
+        self.today = util.get_run_id()
+
+        for run_id, status in [(self.yesterday, "success"), (self.today, "failed")]:
+            self.catalog.start_run(run_id, os.path.join(self.tmp_dir, run_id))
+            self.catalog.finish_run(run_id, status, counts={"projects": 1})
+
+        self.running = self.today + "_running"
+        self.catalog.start_run(self.running, os.path.join(self.tmp_dir, self.running))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_load(self):
+
+        loaded = catalog.SnapshotCatalog(self.tmp_dir)
+
+        self.assertEqual(sorted(loaded.runs), [self.yesterday, self.today, self.running])
+        self.assertEqual(loaded.get_run(self.yesterday)["counts"], {"projects": 1})
+        self.assertEqual(loaded.get_run(self.running)["status"], "running")
+        self.assertEqual(loaded.last_successful, self.yesterday)
+
+
+    def test_load_from_directory(self):
+
+        reports_dir = os.path.join(self.tmp_dir, "reports")
+        for date in ["2018_01_01", "2018_01_02"]:
+            util.create_dir(os.path.join(reports_dir, date))
+
+        loaded = catalog.SnapshotCatalog(reports_dir)
+
+        self.assertEqual(loaded.select_baseline()["run_id"], "2018_01_02")
+
+
+    def test_select_baseline(self):
+
+        self.assertEqual(self.catalog.select_baseline()["run_id"], self.yesterday)
+        self.assertEqual(self.catalog.select_baseline("days_ago:1")["run_id"], self.yesterday)
+        self.assertEqual(self.catalog.select_baseline("run:" + self.yesterday)["run_id"], self.yesterday)
+
+        self.assertIsNone(self.catalog.select_baseline("days_ago:0"))
+        self.assertIsNone(self.catalog.select_baseline("run:unknown"))
+
+
+    def test_select_baseline_not_successful(self):
+
+        self.assertIsNone(self.catalog.select_baseline("run:" + self.today))
+        self.assertIsNone(self.catalog.select_baseline("run:" + self.running))
+
+
+    def test_select_baseline_not_valid(self):
+
+        self.assertIsNone(self.catalog.select_baseline("days_ago:x"))
+        self.assertIsNone(self.catalog.select_baseline("days_ago:"))
+        self.assertIsNone(self.catalog.select_baseline("yesterday"))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   database_test.py
+#
+#   Test the module database.py
+#
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from amigo.lib import database
+
+
+class TestEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.engines = [
+            database.TinyDBEngine(os.path.join(self.tmp_dir, "gcp_reports.json")),
+            database.SQLiteEngine(os.path.join(self.tmp_dir, "gcp_reports.db")),
+        ]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_get_item_key(self):
+
+        self.assertEqual(database.get_item_key({"projectId": "test-163318", "name": "test"}), "test-163318")
+        self.assertEqual(database.get_item_key({"selfLink": "https://link", "id": 1111}), "https://link")
+        self.assertEqual(database.get_item_key({"id": 1111, "name": "default"}), "1111")
+        self.assertIsNone(database.get_item_key({"sourceRanges": ["0.0.0.0/0"]}))
+
+
+    def test_insert_many(self):
+
+        items = [{"projectId": "test-163318"}, {"projectId": "test-163318"}, {"projectId": "test-2"}]
+
+        for engine in self.engines:
+            engine.insert_many("projects", items)
+
+            self.assertEqual(engine.get_table("projects"), items)
+            self.assertEqual(engine.get_item("projects", "test-163318"), items[:2])
+            self.assertEqual(engine.get_snapshots("projects"), [])
+
+
+    def test_upsert_many(self):
+
+        for engine in self.engines:
+            engine.upsert_many("projects", [{"projectId": "test-1", "name": "old"}, {"projectId": "test-2"}], "20180101")
+            engine.upsert_many("projects", [{"projectId": "test-1", "name": "new"}, {"projectId": "test-3"},
+                                            {"projectId": "test-3", "name": "last"}], "20180101")
+
+            snapshot = sorted(engine.get_snapshot("projects", "20180101"), key=lambda item: item["projectId"])
+
+            self.assertEqual(snapshot, [{"projectId": "test-1", "name": "new"}, {"projectId": "test-2"},
+                                        {"projectId": "test-3", "name": "last"}])
+
+
+    def test_snapshots(self):
+
+        for engine in self.engines:
+            engine.insert_many("projects", [{"projectId": "test-0"}])
+            engine.upsert_many("projects", [{"projectId": "test-1"}], "20180102")
+            engine.upsert_many("projects", [{"projectId": "test-1"}, {"projectId": "test-2"}], "20180101")
+
+            # Snapshots are separate from each other and from the items
+            # inserted without one.
+            self.assertEqual(engine.get_snapshots("projects"), ["20180101", "20180102"])
+            self.assertEqual(engine.get_snapshot("projects", "20180102"), [{"projectId": "test-1"}])
+            self.assertEqual(len(engine.get_snapshot("projects", "20180101")), 2)
+            self.assertEqual(engine.get_snapshot("projects", "20180103"), [])
+            self.assertEqual(engine.get_table("projects"), [{"projectId": "test-0"}])
+
+
+
+class FailingEngine():
+    """
+        Engine whose writes always fail.
+    """
+
+    def __init__(self):
+
+        self.closed = False
+
+
+    def insert_many(self, table, items):
+
+        raise IOError("disk full")
+
+
+    def close(self):
+
+        self.closed = True
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "gcp_reports.db")
+        self.items = [{"projectId": "test-{0}".format(number)} for number in range(3)]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def _get_saved(self, db):
+        """
+            Return the items saved in the engine, without flushing the buffer.
+        """
+        return db.database.get_table("projects")
+
+
+    def test_batch_size_tinydb(self):
+
+        db = database.Database(os.path.join(self.tmp_dir, "gcp_reports.json"), engine="tinydb", batch_size=1)
+        self.assertEqual(db.batch_size, database.TINYDB_BATCH_SIZE)
+        db.close()
+
+
+    def test_synchronous(self):
+
+        with database.Database(self.db_path, engine="sqlite", batch_size=1) as db:
+            db.insert("projects", self.items[0])
+
+            self.assertEqual(self._get_saved(db), self.items[:1])
+            self.assertIsNone(db._writer)
+
+
+    def test_batching(self):
+
+        with database.Database(self.db_path, engine="sqlite", batch_size=3, flush_interval=60) as db:
+            db.insert_many("projects", self.items[:2])
+            self.assertEqual(self._get_saved(db), [])
+
+            # The third item fills the batch, which goes to the writer.
+            db.insert("projects", self.items[2])
+            db._queue.join()
+
+            self.assertEqual(self._get_saved(db), self.items)
+
+
+    def test_flush_interval(self):
+
+        with database.Database(self.db_path, engine="sqlite", batch_size=100, flush_interval=0.05) as db:
+            db.insert("projects", self.items[0])
+
+            deadline = time.time() + 5
+            while not self._get_saved(db) and time.time() < deadline:
+                time.sleep(0.01)
+
+            self.assertEqual(self._get_saved(db), self.items[:1])
+
+
+    def test_flush_on_read(self):
+
+        with database.Database(self.db_path, engine="sqlite", batch_size=100, flush_interval=60) as db:
+            db.insert_many("projects", self.items)
+            db.upsert("projects", self.items[0], "20180101")
+
+            self.assertEqual(db.get_table("projects"), self.items)
+            self.assertEqual(db.get_item("projects", "test-1"), self.items[1:2])
+            self.assertEqual(db.get_snapshot("projects"), self.items[:1])
+
+
+    def test_close(self):
+
+        db = database.Database(self.db_path, engine="sqlite", batch_size=100, flush_interval=60)
+        db.insert_many("projects", self.items)
+
+        writer = db._writer
+        self.assertTrue(writer.is_alive())
+
+        db.close()
+
+        self.assertFalse(writer.is_alive())
+        self.assertIsNone(db._writer)
+
+        with database.Database(self.db_path, engine="sqlite") as db:
+            self.assertEqual(db.get_table("projects"), self.items)
+
+
+    def test_write_error(self):
+
+        db = database.Database(self.db_path, engine="sqlite", batch_size=2, flush_interval=60)
+        db.database.close()
+        db.database = FailingEngine()
+
+        db.insert_many("projects", self.items[:2])
+        self.assertRaises(IOError, db.flush)
+
+        # The error is only raised once.
+        db.flush()
+
+        db.insert("projects", self.items[2])
+        self.assertRaises(IOError, db.close)
+
+        self.assertIsNone(db._writer)
+        self.assertTrue(db.database.closed)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
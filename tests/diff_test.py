@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   diff_test.py
+#
+#   Test the module diff.py
+#
+
+import unittest
+from amigo.lib import diff
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.firewall = {
+                "kind": "compute#firewall",
+                "id": "1111",
+                "name": "default-allow-ssh",
+                "sourceRanges": ["0.0.0.0/0"],
+                "allowed": [{"IPProtocol": "tcp", "ports": ["22"]}],
+            }
+        self.firewall_2 = {
+                "kind": "compute#firewall",
+                "id": "2222",
+                "name": "default-allow-icmp",
+                "sourceRanges": ["0.0.0.0/0"],
+                "allowed": [{"IPProtocol": "icmp"}],
+            }
+
+
+    def test_diff_resources_no_diff(self):
+
+        test_diff = diff.diff_resources([self.firewall, self.firewall_2], [self.firewall_2, self.firewall])
+
+        self.assertFalse(diff.has_diff(test_diff))
+        self.assertFalse(diff.has_diff(diff.diff_resources([], [])))
+
+
+    def test_diff_resources_added_removed(self):
+
+        test_diff = diff.diff_resources([self.firewall], [self.firewall_2])
+
+        self.assertEqual(test_diff["added"], [self.firewall_2])
+        self.assertEqual(test_diff["removed"], [self.firewall])
+        self.assertEqual(test_diff["changed"], [])
+
+
+    def test_diff_resources_changed(self):
+
+        firewall_changed = dict(self.firewall, allowed=[{"IPProtocol": "tcp", "ports": ["22", "80"]}])
+        test_diff = diff.diff_resources([self.firewall], [firewall_changed])
+
+        self.assertEqual(test_diff["added"], [])
+        self.assertEqual(test_diff["removed"], [])
+        self.assertEqual(test_diff["changed"], [{"key": "id:1111", "changes": [
+                            {"path": "allowed[0].ports", "old": ["22"], "new": ["22", "80"]}]}])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
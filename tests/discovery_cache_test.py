@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   discovery_cache_test.py
+#
+#   Test the module discovery_cache.py
+#
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from amigo.lib import discovery_cache
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.document = '{"name": "compute", "version": "v1"}'
+        self.fetched = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def _get_cache(self, offline=False, document=None):
+
+        cache = discovery_cache.DiscoveryCache(self.tmp_dir, ttl=3600, offline=offline)
+
+        def fetch_document(api, version):
+            self.fetched.append((api, version))
+            return document
+
+        cache._fetch_document = fetch_document
+
+        return cache
+
+
+    def _save_cache_file(self, content, age=0):
+
+        cache_file = os.path.join(self.tmp_dir, "compute@v1.json")
+
+        with open(cache_file, "w") as f:
+            f.write(content)
+
+        mtime = time.time() - age
+        os.utime(cache_file, (mtime, mtime))
+
+        return cache_file
+
+
+    def _read_cache_file(self):
+
+        with open(os.path.join(self.tmp_dir, "compute@v1.json")) as f:
+            return f.read()
+
+
+    def test_get_document_fetched(self):
+
+        cache = self._get_cache(document=self.document)
+
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+        self.assertEqual(self._read_cache_file(), self.document)
+
+        # Loaded documents are not fetched again in the same run.
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+        self.assertEqual(self.fetched, [("compute", "v1")])
+
+
+    def test_get_document_fresh(self):
+
+        self._save_cache_file(self.document, age=60)
+        cache = self._get_cache(document='{"name": "new"}')
+
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+        self.assertEqual(self.fetched, [])
+
+
+    def test_get_document_expired(self):
+
+        self._save_cache_file(self.document, age=7200)
+        cache = self._get_cache(document='{"name": "new"}')
+
+        self.assertEqual(cache.get_document("compute", "v1"), '{"name": "new"}')
+        self.assertEqual(self._read_cache_file(), '{"name": "new"}')
+        self.assertEqual(self.fetched, [("compute", "v1")])
+
+
+    def test_get_document_expired_unreachable(self):
+
+        self._save_cache_file(self.document, age=7200)
+        cache = self._get_cache()
+
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+
+
+    def test_get_document_offline(self):
+
+        cache = self._get_cache(offline=True, document=self.document)
+        self.assertIsNone(cache.get_document("compute", "v1"))
+
+        # Expired documents are still used offline.
+        self._save_cache_file(self.document, age=7200)
+        cache = self._get_cache(offline=True, document='{"name": "new"}')
+
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+        self.assertEqual(self.fetched, [])
+
+
+    def test_get_document_corrupt(self):
+
+        self._save_cache_file('{"name": "comp', age=60)
+        cache = self._get_cache(document=self.document)
+
+        self.assertEqual(cache.get_document("compute", "v1"), self.document)
+        self.assertEqual(self._read_cache_file(), self.document)
+        self.assertEqual(self.fetched, [("compute", "v1")])
+
+        self._save_cache_file('{"name": "comp', age=60)
+        cache = self._get_cache(offline=True, document=self.document)
+
+        self.assertIsNone(cache.get_document("compute", "v1"))
+        self.assertEqual(self.fetched, [("compute", "v1")])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   findings_test.py
+#
+#   Test the module findings.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import findings
+
+
+class TestFindings(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "findings.db")
+
+        self.violation = {
+                "name": "Violation for firewalls in test-163318",
+                "resource": "firewalls",
+                "project": "test-163318",
+                "violation": {
+                    "rule": "check_firewall_open_all",
+                    "resource_data": {"id": "1111", "sourceRanges": ["0.0.0.0/0"]},
+                },
+            }
+        self.warning = {"name": "Warning when Running Amigo", "warnings": "API disabled"}
+
+        self.diff = {
+                "name": "Difference in Resources",
+                "resource": "test-163318",
+                "attribute": "firewalls",
+                "diff": {"added": [], "removed": [], "changed": [{"key": "1111", "changes": []}]},
+            }
+        self.number_projects = {"name": "Number of Resources has changed", "resource": "test-2", "attribute": "new"}
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_get_fingerprint(self):
+
+        changed_violation = dict(self.violation, violation={
+                "rule": "check_firewall_open_all",
+                "resource_data": {"id": "1111", "sourceRanges": ["0.0.0.0/1"]},
+            })
+
+        self.assertEqual(findings.get_fingerprint(self.violation), findings.get_fingerprint(changed_violation))
+        self.assertNotEqual(findings.get_fingerprint(self.violation), findings.get_fingerprint(self.warning))
+
+
+    def test_update(self):
+
+        with findings.FindingsStore(self.db_path) as store:
+            new, resolved, still_open, events = store.update([self.violation, self.warning], "2018_01_01_00_00_00")
+            self.assertEqual([finding["finding_status"] for finding in new], ["new", "new"])
+            self.assertEqual((resolved, still_open, events), ([], [], []))
+
+        with findings.FindingsStore(self.db_path) as store:
+            new, resolved, still_open, events = store.update([self.violation], "2018_01_02_00_00_00")
+            self.assertEqual(new, [])
+            self.assertEqual([finding["warnings"] for finding in resolved], ["API disabled"])
+            self.assertEqual(resolved[0]["finding_status"], "resolved")
+            self.assertEqual(still_open[0]["finding_status"], "open")
+
+            new, resolved, still_open, events = store.update([self.violation, self.warning], "2018_01_03_00_00_00")
+            self.assertEqual(len(new), 1)
+            self.assertEqual(len(store.get_open()), 2)
+
+
+    def test_update_analyzed_keys(self):
+
+        with findings.FindingsStore(self.db_path) as store:
+            store.update([self.violation, self.warning], "2018_01_01_00_00_00")
+
+            # The firewalls of test-163318 were not analyzed, so only the warning is resolved.
+            new, resolved, still_open, events = store.update([], "2018_01_02_00_00_00", set([("test-163318", "networks")]))
+            self.assertEqual([finding["warnings"] for finding in resolved], ["API disabled"])
+            self.assertEqual([finding["finding_status"] for finding in still_open], ["open"])
+            self.assertEqual(still_open[0]["violation"], self.violation["violation"])
+
+            new, resolved, still_open, events = store.update([], "2018_01_03_00_00_00", set([("test-163318", "firewalls")]))
+            self.assertEqual([finding["finding_status"] for finding in resolved], ["resolved"])
+            self.assertEqual(store.get_open(), set())
+
+
+    def test_update_events(self):
+
+        with findings.FindingsStore(self.db_path) as store:
+            new, resolved, still_open, events = store.update([self.diff, self.number_projects, self.violation],
+                                                             "2018_01_01_00_00_00")
+            self.assertEqual(events, [self.diff, self.number_projects])
+            self.assertEqual(len(new), 1)
+
+            # Events are emitted every run they happen, and never resolved.
+            new, resolved, still_open, events = store.update([self.diff, self.violation], "2018_01_02_00_00_00")
+            self.assertEqual(events, [self.diff])
+            self.assertEqual((new, resolved, len(still_open)), ([], [], 1))
+
+            new, resolved, still_open, events = store.update([self.violation], "2018_01_03_00_00_00")
+            self.assertEqual((new, resolved, events), ([], [], []))
+            self.assertEqual(store.get_open(), set([findings.get_fingerprint(self.violation)]))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,310 @@
 #   Test the module gcp.py
 #
 
+import os
+import shutil
+import httplib2
+import tempfile
 import unittest
+import threading
 from amigo.lib import gcp
+from amigo.lib import ratelimit
+from googleapiclient import errors
+
+
+class FakeGCPWrapper():
+    """
+        Stands in for gcp.GCPWrapper, serving resources from memory instead
+        of GCP. Requests are recorded in calls (and batch requests in
+        batch_calls), and the warnings set for a (project, attribute) are
+        added when it is fetched.
+    """
+    resources = {}
+    errors = {}
+    calls = []
+    batch_calls = []
+
+    def __init__(self, config, entity, version, registry=None):
+
+        self.entity = entity
+        self.warnings = []
+
+
+    @classmethod
+    def reset(cls, resources, errors=None):
+
+        cls.resources = resources
+        cls.errors = errors or {}
+        cls.calls = []
+        cls.batch_calls = []
+
+
+    def iter_attribute(self, attribute, project=None, fields=None, max_results=None):
+
+        FakeGCPWrapper.calls.append((project, attribute, fields))
+
+        if (project, attribute) in self.errors:
+            self.warnings.append(self.errors[(project, attribute)])
+            return
+
+        for item in self._get_items(attribute, project, fields):
+            yield item
+
+
+    def _get_items(self, attribute, project, fields):
+
+        for item in self.resources.get((project, attribute), []):
+            if fields:
+                item = dict((key, value) for key, value in item.items() if key in gcp.IDENTITY_FIELDS + list(fields))
+            yield item
+
+
+    def iter_attribute_batch(self, attribute, projects, fields=None, max_results=None, batch_size=100):
+
+        for start in range(0, len(projects), batch_size):
+            batch_projects = projects[start:start + batch_size]
+            FakeGCPWrapper.batch_calls.append((tuple(batch_projects), attribute, fields))
+
+            for project in batch_projects:
+                if (project, attribute) in self.errors:
+                    self.warnings.append(self.errors[(project, attribute)])
+                else:
+                    yield project, self._get_items(attribute, project, fields)
+
+
+    def fetch_attribute(self, attribute, project=None, fields=None, max_results=None):
+
+        return list(self.iter_attribute(attribute, project=project, fields=fields, max_results=max_results))
+
+
+class FakeRequest():
+    """
+        List request of a project, failing with the given errors before it
+        returns its response.
+    """
+
+    def __init__(self, outcomes):
+
+        self.outcomes = list(outcomes)
+        self.executions = 0
+
+
+    def execute(self):
+
+        self.executions += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return outcome
+
+
+class FakeBatch():
+
+    def __init__(self, callback):
+
+        self.callback = callback
+        self.requests = []
+        self.executions = 0
+
+
+    def add(self, request, request_id):
+
+        self.requests.append((request_id, request))
+
+
+    def execute(self):
+
+        self.executions += 1
+
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except errors.HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeService():
+    """
+        Compute service whose firewalls are listed from a dict of requests
+        by project.
+    """
+
+    def __init__(self, requests):
+
+        self.requests = requests
+        self.batches = []
+
+
+    def firewalls(self):
+
+        return self
+
+
+    def list(self, project, **params):
+
+        return self.requests[project]
+
+
+    def list_next(self, previous_request, previous_response):
+
+        return None
+
+
+    def new_batch_http_request(self, callback):
+
+        self.batches.append(FakeBatch(callback))
+        return self.batches[-1]
+
+
+class FakeRegistry():
+
+    def __init__(self, service):
+
+        self.service = service
+        self.limiter = ratelimit.RateLimiter("compute", requests_per_second=1000, burst=1000, max_concurrency=4,
+                                             backoff_base=0, retry_budget=ratelimit.RetryBudget(10))
+
+
+    def get_service(self, entity, version):
+
+        return self.service
+
+
+    def get_limiter(self, entity):
+
+        return self.limiter
+
+
+class FakeStorage():
+    """
+        Stands in for the oauth2client Storage of the credentials file.
+    """
+    created = []
+
+    def __init__(self, filename):
+
+        FakeStorage.created.append(filename)
+        self.credentials = None
+
+
+    def put(self, credentials):
+
+        self.credentials = credentials
+
+
+    def get(self):
+
+        return self.credentials
+
+
+class FakeCredentials():
+
+    calls = []
+
+    @classmethod
+    def get_application_default(cls):
+
+        cls.calls.append("get_application_default")
+        return "credentials"
+
+
+class FakeDiscovery():
+
+    def __init__(self):
+
+        self.built = []
+        self._lock = threading.Lock()
+
+
+    def build_from_document(self, document, credentials=None):
+
+        with self._lock:
+            self.built.append((document, credentials))
+
+        return object()
+
+
+class FakeDiscoveryCache():
+
+    def __init__(self, cache_dir, ttl=86400, offline=False):
+        pass
+
+
+    def get_document(self, api, version):
+
+        return api + "@" + version
+
+
+class TestGCPClientRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.key_file = os.path.join(self.tmp_dir, "key.json")
+        open(self.key_file, "w").close()
+
+        self.patched = dict((name, getattr(gcp, name)) for name in ["Storage", "GoogleCredentials", "discovery", "DiscoveryCache"])
+
+        FakeStorage.created = []
+        FakeCredentials.calls = []
+        self.discovery = FakeDiscovery()
+
+        gcp.Storage = FakeStorage
+        gcp.GoogleCredentials = FakeCredentials
+        gcp.discovery = self.discovery
+        gcp.DiscoveryCache = FakeDiscoveryCache
+
+
+    def tearDown(self):
+        for name, value in self.patched.items():
+            setattr(gcp, name, value)
+
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_get_service(self):
+
+        registry = gcp.GCPClientRegistry({"local_cred_file": os.path.join(self.tmp_dir, "creds.json"),
+                                          "key_file": self.key_file})
+        services = {}
+
+        def build_services(thread_number):
+            services[thread_number] = [registry.get_service(entity, "v1") for entity in ["compute", "storage", "compute"]]
+
+        threads = [threading.Thread(target=build_services, args=(number,)) for number in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Authentication runs once for the whole run.
+        self.assertEqual(len(FakeStorage.created), 1)
+        self.assertEqual(FakeCredentials.calls, ["get_application_default"])
+
+        # Every thread builds each service once, and reuses it.
+        self.assertEqual(sorted(document for document, _ in self.discovery.built), ["compute@v1"] * 3 + ["storage@v1"] * 3)
+        self.assertEqual(set(credentials for _, credentials in self.discovery.built), set(["credentials"]))
+
+        for compute, storage, compute_again in services.values():
+            self.assertIs(compute, compute_again)
+            self.assertIsNot(compute, storage)
+
+        self.assertEqual(len(set(id(thread_services[0]) for thread_services in services.values())), 3)
+
+
+    def test_get_service_no_credentials(self):
+
+        registry = gcp.GCPClientRegistry({"local_cred_file": os.path.join(self.tmp_dir, "creds.json"),
+                                          "key_file": os.path.join(self.tmp_dir, "missing.json")})
+
+        self.assertIsNone(registry.get_service("compute", "v1"))
+        self.assertIsNone(registry.get_service("storage", "v1"))
+
+        # A failed authentication is not tried again.
+        self.assertEqual(len(FakeStorage.created), 1)
+        self.assertEqual(self.discovery.built, [])
 
 
 class TestGCPWrapper(unittest.TestCase):
@@ -20,6 +322,42 @@ class TestGCPWrapper(unittest.TestCase):
         pass
 
 
+    def test_get_fields_mask(self):
+
+        mask = gcp.get_fields_mask(["sourceRanges", "allowed", "name"])
+
+        self.assertEqual(mask, "items(id,name,selfLink,allowed,sourceRanges),nextPageToken")
+
+
+    def test_get_fields_mask_identity_only(self):
+
+        self.assertEqual(gcp.get_fields_mask([]), "items(id,name,selfLink),nextPageToken")
+
+
+    def test_iter_attribute_batch(self):
+
+        items = [{"id": "1111", "name": "default-allow-ssh"}]
+        requests = {
+            "test-1": FakeRequest([{"items": items}]),
+            "test-2": FakeRequest([errors.HttpError(httplib2.Response({"status": 503}), b"{}"), {"items": items}]),
+            "test-3": FakeRequest([errors.HttpError(httplib2.Response({"status": 404}), b"{}")]),
+        }
+        service = FakeService(requests)
+        registry = FakeRegistry(service)
+
+        wrapper = gcp.GCPWrapper({}, "compute", "v1", registry=registry)
+        results = dict((project, list(project_items)) for project, project_items
+                       in wrapper.iter_attribute_batch("firewalls", sorted(requests)))
+
+        self.assertEqual(results, {"test-1": items, "test-2": items})
+        self.assertEqual(len(wrapper.warnings), 1)
+
+        # The batch is sent once, and only the throttled project is retried.
+        self.assertEqual([batch.executions for batch in service.batches], [1])
+        self.assertEqual([requests[project].executions for project in sorted(requests)], [1, 2, 1])
+        self.assertEqual(registry.limiter.in_flight, 0)
+
+
 
 if __name__ == '__main__':
     unittest.main()
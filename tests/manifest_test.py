@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   manifest_test.py
+#
+#   Test the module manifest.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import manifest
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.reports_path = os.path.join(self.tmp_dir, "20180101")
+        util.create_dir(self.reports_path)
+
+        self.items = [
+            {"id": "1111", "name": "default-allow-ssh", "sourceRanges": ["0.0.0.0/0"]},
+            {"id": "2222", "name": "default-allow-icmp", "sourceRanges": ["0.0.0.0/0"]},
+        ]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def _get_hashes(self, items):
+
+        return [util.get_content_hash(item) for item in items]
+
+
+    def test_get_root_hash(self):
+
+        root_hash = manifest.get_root_hash(self._get_hashes(self.items))
+
+        self.assertEqual(manifest.get_root_hash(self._get_hashes(self.items[::-1])), root_hash)
+        self.assertNotEqual(manifest.get_root_hash(self._get_hashes(self.items[:1])), root_hash)
+
+
+    def test_get_root_hash_same_key(self):
+
+        # Items with the same key, or duplicate items without one, all count.
+        same_id = [{"id": "1111", "name": "a"}, {"id": "1111", "name": "b"}]
+        self.assertNotEqual(manifest.get_root_hash(self._get_hashes(same_id)),
+                            manifest.get_root_hash(self._get_hashes(same_id[1:])))
+
+        keyless = [{"sourceRanges": ["0.0.0.0/0"]}]
+        self.assertNotEqual(manifest.get_root_hash(self._get_hashes(keyless * 2)),
+                            manifest.get_root_hash(self._get_hashes(keyless)))
+
+
+    def test_add_and_save(self):
+
+        report_manifest = manifest.ReportManifest(self.reports_path)
+        resource_hashes = dict(zip(["1111", "2222"], self._get_hashes(self.items)))
+
+        report_manifest.add("test-163318", "firewalls", "test-163318@firewalls.jsonl", resource_hashes,
+                            self._get_hashes(self.items), marker="abcdef")
+        self.assertTrue(report_manifest.save())
+
+        entry = manifest.ReportManifest(self.reports_path).get("test-163318", "firewalls")
+
+        self.assertEqual(entry["count"], 2)
+        self.assertEqual(entry["hash"], manifest.get_root_hash(self._get_hashes(self.items)))
+        self.assertEqual(entry["resources"], resource_hashes)
+        self.assertEqual(entry["marker"], "abcdef")
+        self.assertEqual(report_manifest.get_report_path("test-163318", "firewalls"),
+                         os.path.join(self.reports_path, "test-163318@firewalls.jsonl"))
+        self.assertIsNone(report_manifest.get_report_path("test-163318", "networks"))
+
+
+    def test_load_from_directory(self):
+
+        # Reports of older runs: ".json" reports of the oldest runs, and JSON
+        # Lines reports saved before the manifest existed.
+        util.save_to_json_file(self.items[0], os.path.join(self.reports_path, "test-163318@firewalls.json"))
+        util.save_to_jsonl_file(self.items, os.path.join(self.reports_path, "test-163318@networks.jsonl.gz"))
+        util.save_to_json_file([], os.path.join(self.reports_path, "catalog.json"))
+
+        report_manifest = manifest.ReportManifest(self.reports_path)
+
+        self.assertEqual(report_manifest.keys(), set([("test-163318", "firewalls"), ("test-163318", "networks")]))
+        self.assertEqual(util.read_jsonl_file(report_manifest.get_report_path("test-163318", "firewalls")), self.items[:1])
+        self.assertNotIn("hash", report_manifest.get("test-163318", "firewalls"))
+
+
+    def test_get_changed_resources(self):
+
+        item_hashes = self._get_hashes(self.items)
+        changed_items = [self.items[0], dict(self.items[1], sourceRanges=["10.0.0.0/8"])]
+        changed_hashes = self._get_hashes(changed_items)
+
+        entry = {"hash": manifest.get_root_hash(item_hashes), "resources": dict(zip(["1111", "2222"], item_hashes))}
+        changed_entry = {"hash": manifest.get_root_hash(changed_hashes), "resources": dict(zip(["1111", "2222"], changed_hashes))}
+
+        self.assertEqual(manifest.get_changed_resources(entry, dict(entry)), set())
+        self.assertEqual(manifest.get_changed_resources(changed_entry, entry), set(["2222"]))
+        self.assertIsNone(manifest.get_changed_resources(entry, {"report": "test-163318@firewalls.jsonl"}))
+        self.assertIsNone(manifest.get_changed_resources(entry, None))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   network_test.py
+#
+#   Test the module network.py
+#
+
+import socket
+import unittest
+from amigo.lib import network
+
+
+class TestNetwork(unittest.TestCase):
+
+    def test_parse_cidr(self):
+
+        self.assertEqual(network.parse_cidr("10.0.0.0/8"), (socket.AF_INET, 0x0A000000, 0x0AFFFFFF))
+        self.assertEqual(network.parse_cidr("10.1.2.3"), (socket.AF_INET, 0x0A010203, 0x0A010203))
+        self.assertEqual(network.parse_cidr("10.1.2.3/8")[1:], (0x0A000000, 0x0AFFFFFF))
+        self.assertEqual(network.parse_cidr("::/0"), (socket.AF_INET6, 0, (1 << 128) - 1))
+        self.assertRaises(ValueError, network.parse_cidr, "10.0.0.0/33")
+        self.assertRaises(ValueError, network.parse_cidr, "internet")
+
+
+    def test_parse_port_range(self):
+
+        self.assertEqual(network.parse_port_range("22"), (22, 22))
+        self.assertEqual(network.parse_port_range(22), (22, 22))
+        self.assertEqual(network.parse_port_range("8000-9000"), (8000, 9000))
+        self.assertRaises(ValueError, network.parse_port_range, "9000-8000")
+        self.assertRaises(ValueError, network.parse_port_range, "ssh")
+
+
+    def test_interval_index(self):
+
+        index = network.IntervalIndex([(30, 40), (1, 5), (6, 10), (8, 12)])
+
+        self.assertEqual(len(index), 2)
+        self.assertTrue(index.overlaps(12, 20))
+        self.assertTrue(index.overlaps(0, 1))
+        self.assertFalse(index.overlaps(13, 29))
+        self.assertFalse(index.overlaps(41, 50))
+        self.assertTrue(index.contains(2, 12))
+        self.assertFalse(index.contains(10, 14))
+        self.assertFalse(index.contains(0, 3))
+
+
+    def test_network_index(self):
+
+        index = network.NetworkIndex(["0.0.0.0/0"])
+
+        self.assertTrue(index.overlaps("0.0.0.0/1"))
+        self.assertTrue(index.overlaps("35.191.0.0/16"))
+        self.assertFalse(index.overlaps("2600:1900::/28"))
+        self.assertFalse(index.overlaps("not-a-cidr"))
+        self.assertFalse(network.NetworkIndex(["10.0.0.0/8"]).overlaps("192.168.0.0/16"))
+        self.assertTrue(network.NetworkIndex(["10.0.0.0/8"]).contains("10.128.0.0/9"))
+        self.assertFalse(network.NetworkIndex(["10.0.0.0/8"]).contains("0.0.0.0/0"))
+
+
+    def test_port_index(self):
+
+        index = network.PortIndex([22, "3389"])
+
+        self.assertTrue(index.overlaps_ports(["20-25"]))
+        self.assertTrue(index.overlaps_ports(["80", "3389"]))
+        self.assertFalse(index.overlaps_ports(["80", "443", "ssh"]))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   ratelimit_test.py
+#
+#   Test the module ratelimit.py
+#
+
+import httplib2
+import unittest
+from amigo.lib import ratelimit
+from googleapiclient import errors
+from tests.gcp_test import FakeRequest
+
+
+class FakeClock():
+    """
+        Replaces the time module, so sleeping only moves the clock.
+    """
+
+    def __init__(self):
+
+        self.now = 1000.0
+        self.sleeps = []
+
+
+    def time(self):
+
+        return self.now
+
+
+    def sleep(self, seconds):
+
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def get_http_error(status, content=b"{}"):
+
+    return errors.HttpError(httplib2.Response({"status": status}), content)
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.time = ratelimit.time
+        ratelimit.time = self.clock
+
+
+    def tearDown(self):
+        ratelimit.time = self.time
+
+
+    def test_is_retryable(self):
+
+        for status in [429, 500, 502, 503, 504]:
+            self.assertTrue(ratelimit.is_retryable(get_http_error(status)))
+
+        self.assertTrue(ratelimit.is_retryable(get_http_error(403, b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')))
+        self.assertFalse(ratelimit.is_retryable(get_http_error(403, b'{"error": {"errors": [{"reason": "forbidden"}]}}')))
+        self.assertFalse(ratelimit.is_retryable(get_http_error(404)))
+
+
+    def test_token_bucket(self):
+
+        limiter = ratelimit.RateLimiter("compute", requests_per_second=10, burst=2)
+
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release()
+
+        # The burst goes through at once, then requests wait for a token.
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.sleeps[0], 0.1)
+
+        # Tokens refill with time, up to the burst.
+        self.clock.now += 60
+        for _ in range(2):
+            limiter.acquire()
+            limiter.release()
+
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(limiter.tokens, 0)
+
+
+    def test_invalid_rate(self):
+
+        limiter = ratelimit.RateLimiter("compute", requests_per_second=0, burst=0)
+
+        self.assertEqual(limiter.rate, ratelimit.DEFAULT_REQUESTS_PER_SECOND)
+        self.assertEqual(limiter.burst, ratelimit.DEFAULT_BURST)
+
+
+    def test_aimd(self):
+
+        limiter = ratelimit.RateLimiter("compute", requests_per_second=1000, burst=1000, max_concurrency=4)
+        self.assertEqual(int(limiter.concurrency), 4)
+
+        # Multiplicative decrease, down to one request at a time.
+        for concurrency in [2, 1, 1]:
+            limiter.acquire()
+            limiter.release(throttled=True)
+            self.assertEqual(limiter.concurrency, concurrency)
+
+        # Additive increase, up to max_concurrency.
+        for concurrency in [2, 2.5, 2.9]:
+            limiter.acquire()
+            limiter.release()
+            self.assertAlmostEqual(limiter.concurrency, concurrency)
+
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release()
+
+        self.assertEqual(limiter.concurrency, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+    def test_execute_retries(self):
+
+        budget = ratelimit.RetryBudget(10)
+        limiter = ratelimit.RateLimiter("compute", max_concurrency=4, retry_budget=budget)
+        request = FakeRequest([get_http_error(503), get_http_error(429), {"items": []}])
+
+        self.assertEqual(limiter.execute(request), {"items": []})
+        self.assertEqual(request.executions, 3)
+        self.assertEqual(budget.retries, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+        # Backoff grows exponentially, with full jitter.
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertTrue(0 <= self.clock.sleeps[0] <= 1)
+        self.assertTrue(0 <= self.clock.sleeps[1] <= 2)
+
+        # Throttling halved the concurrency twice (4 to 1), then the
+        # success increased it again.
+        self.assertEqual(limiter.concurrency, 2)
+
+
+    def test_execute_not_retryable(self):
+
+        limiter = ratelimit.RateLimiter("compute", retry_budget=ratelimit.RetryBudget(10))
+        request = FakeRequest([get_http_error(404), {"items": []}])
+
+        self.assertRaises(errors.HttpError, limiter.execute, request)
+        self.assertEqual(request.executions, 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+    def test_execute_max_retries(self):
+
+        limiter = ratelimit.RateLimiter("compute", max_retries=2, retry_budget=ratelimit.RetryBudget(10))
+        request = FakeRequest([get_http_error(503)])
+
+        self.assertRaises(errors.HttpError, limiter.execute, request)
+        self.assertEqual(request.executions, 3)
+
+
+    def test_retry_budget(self):
+
+        budget = ratelimit.RetryBudget(1)
+        limiters = [ratelimit.RateLimiter(name, retry_budget=budget) for name in ["compute", "storage"]]
+
+        request = FakeRequest([get_http_error(503)])
+        self.assertRaises(errors.HttpError, limiters[0].execute, request)
+        self.assertEqual(request.executions, 2)
+
+        # The budget is shared, so the other API has no retries left.
+        request = FakeRequest([get_http_error(503)])
+        self.assertRaises(errors.HttpError, limiters[1].execute, request)
+        self.assertEqual(request.executions, 1)
+        self.assertFalse(budget.withdraw())
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   reporter_test.py
+#
+#   Test the module reporter.py
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import reporter
+from amigo.lib import database
+from amigo.lib import analytics
+from amigo.lib import findings
+from tests.gcp_test import FakeGCPWrapper
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RULES_FILE = os.path.join(ROOT_DIR, "rules.yaml")
+
+
+class BrokenGCPWrapper(FakeGCPWrapper):
+
+    def iter_attribute(self, attribute, project=None, fields=None, max_results=None):
+
+        raise RuntimeError("connection reset")
+
+
+class TestReporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.projects = [{"projectId": "test-{0}".format(number), "lifecycleState": "ACTIVE"} for number in range(5)]
+
+        resources = {(None, "projects"): self.projects}
+        for project in self.projects:
+            project_name = project["projectId"]
+            resources[(project_name, "firewalls")] = [
+                {"id": project_name + "-1", "name": "default-allow-ssh", "sourceRanges": ["0.0.0.0/0"],
+                 "allowed": [{"IPProtocol": "tcp", "ports": ["22"]}]},
+                {"id": project_name + "-2", "name": "default-allow-icmp", "sourceRanges": ["0.0.0.0/0"]},
+            ]
+            resources[(project_name, "networks")] = [{"id": project_name + "-3", "name": "default"}]
+
+        errors = {
+            ("test-1", "networks"): "networks of test-1 failed",
+            ("test-3", "firewalls"): "firewalls of test-3 failed",
+        }
+        FakeGCPWrapper.reset(resources, errors)
+
+        self.gcp_wrapper = reporter.GCPWrapper
+        reporter.GCPWrapper = FakeGCPWrapper
+
+        # The Reporter reads ./rules.yaml in incremental mode.
+        self.cwd = os.getcwd()
+        os.chdir(ROOT_DIR)
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        reporter.GCPWrapper = self.gcp_wrapper
+        shutil.rmtree(self.tmp_dir)
+
+
+    def _get_config(self, name, **settings):
+
+        run_dir = os.path.join(self.tmp_dir, name)
+
+        config = {
+            "reports_dir": os.path.join(run_dir, "output"),
+            "results_dir": os.path.join(run_dir, "log"),
+            "results_log_file": "amigo.log",
+            "database_engine": "sqlite",
+            "database_sqlite": os.path.join(run_dir, "gcp_reports.db"),
+            "discovery_cache_dir": os.path.join(run_dir, ".discovery_cache"),
+            "gcp_attributes": {"compute": ["firewalls", "networks"]},
+        }
+        config.update(settings)
+
+        return config
+
+
+    def _get_reporter(self, config, run_id):
+        """
+            Return a Reporter whose run starts at the time of the given run ID
+            (e.g. days ago).
+        """
+        get_run_id = util.get_run_id
+        util.get_run_id = lambda days_ago=0: run_id
+
+        try:
+            return reporter.Reporter(config)
+        finally:
+            util.get_run_id = get_run_id
+
+
+    def _drain(self, report_queue):
+
+        keys = []
+        while not report_queue.empty():
+            keys.append(report_queue.get())
+
+        return keys
+
+
+    def _get_reports(self, reports_path):
+
+        reports = {}
+        for report_path in util.list_files_in_dir(reports_path, "*.jsonl"):
+            reports[os.path.basename(report_path)] = util.read_jsonl_file(report_path)
+
+        return reports
+
+
+    def test_run_concurrent(self):
+
+        serial = reporter.Reporter(self._get_config("serial"))
+        serial_reports, _ = serial.run()
+
+        concurrent = reporter.Reporter(self._get_config("concurrent", fetch_workers=4))
+        concurrent_reports, _ = concurrent.run()
+
+        self.assertEqual(len(self._get_reports(concurrent_reports)), 8)
+        self.assertEqual(self._get_reports(concurrent_reports), self._get_reports(serial_reports))
+        self.assertEqual(concurrent.manifest.keys(), serial.manifest.keys())
+
+        # Warnings are collected in task order, as in the serial path.
+        self.assertEqual(concurrent.warnings, serial.warnings)
+        self.assertEqual(concurrent.warnings, ["networks of test-1 failed", "firewalls of test-3 failed"])
+
+        with database.Database(concurrent.database_path, engine="sqlite") as db:
+            self.assertEqual(len(db.get_snapshot("projects", concurrent.run_id)), 5)
+
+
+    def test_run_id_same_second(self):
+
+        config = self._get_config("same-second")
+        reporters = [self._get_reporter(config, "2018_01_01_00_00_00") for _ in range(3)]
+
+        self.assertEqual([amigo_reporter.run_id for amigo_reporter in reporters],
+                         ["2018_01_01_00_00_00", "2018_01_01_00_00_00_1", "2018_01_01_00_00_00_2"])
+        self.assertEqual(len(set(amigo_reporter.reports for amigo_reporter in reporters)), 3)
+
+        for amigo_reporter in reporters:
+            amigo_reporter.run()
+
+        # The runs sort in the order they started, for the baseline.
+        self.assertEqual(self._get_reporter(config, "2018_01_01_00_00_01").previous_reports, reporters[-1].reports)
+
+
+    def test_run_batch(self):
+
+        serial = reporter.Reporter(self._get_config("serial"))
+        serial_reports, _ = serial.run()
+
+        for fetch_workers in [1, 3]:
+            FakeGCPWrapper.batch_calls = []
+
+            batch = reporter.Reporter(self._get_config("batch-{0}".format(fetch_workers), fetch_batch_size=2,
+                                                       fetch_workers=fetch_workers))
+            batch_reports, _ = batch.run()
+
+            self.assertEqual(self._get_reports(batch_reports), self._get_reports(serial_reports))
+            self.assertEqual(batch.manifest.keys(), serial.manifest.keys())
+
+            # Warnings are collected by attribute, rather than by project.
+            self.assertEqual(sorted(batch.warnings), sorted(serial.warnings))
+
+            # Every attribute is requested for 5 projects in batches of 2.
+            self.assertEqual(len(FakeGCPWrapper.batch_calls), 6)
+
+
+    def test_run_report_queue(self):
+
+        report_queue = queue.Queue()
+        amigo_reporter = reporter.Reporter(self._get_config("queue", fetch_workers=4))
+        amigo_reporter.run(report_queue)
+
+        keys = self._drain(report_queue)
+
+        # Every saved report is put once, and None at the end.
+        self.assertEqual(keys[-1], None)
+        self.assertEqual(len(keys[:-1]), len(set(keys[:-1])))
+        self.assertEqual(set(keys[:-1]), amigo_reporter.manifest.keys())
+
+
+    def test_run_report_queue_failed(self):
+
+        reporter.GCPWrapper = BrokenGCPWrapper
+
+        report_queue = queue.Queue()
+        amigo_reporter = reporter.Reporter(self._get_config("failed"))
+
+        self.assertRaises(RuntimeError, amigo_reporter.run, report_queue)
+        self.assertEqual(self._drain(report_queue), [None])
+        self.assertEqual(amigo_reporter.catalog.get_run(amigo_reporter.run_id)["status"], "failed")
+
+
+    def test_pipeline(self):
+
+        config = self._get_config("pipeline", fetch_workers=4)
+        self._get_reporter(config, "2018_01_01_00_00_00").run()
+
+        # A firewall of test-0 is no longer open to the world.
+        firewall = FakeGCPWrapper.resources[("test-0", "firewalls")][0]
+        FakeGCPWrapper.resources[("test-0", "firewalls")][0] = dict(firewall, sourceRanges=["10.0.0.0/8"])
+
+        amigo_reporter = self._get_reporter(config, "2018_01_02_00_00_00")
+        self.assertTrue(amigo_reporter.previous_reports.endswith("2018_01_01_00_00_00"))
+
+        # A small queue, so the Reporter waits on the analysis.
+        analyzer = analytics.Analytics(amigo_reporter.reports, amigo_reporter.previous_reports, manifest=amigo_reporter.manifest)
+        analyzer.rules_file = RULES_FILE
+
+        report_queue = queue.Queue(maxsize=1)
+        analyzer.start_stream(report_queue)
+        amigo_reporter.run(report_queue)
+        diff_results, violation_results = analyzer.finish_stream()
+
+        self.assertEqual(len(diff_results), 1)
+        self.assertEqual((diff_results[0]["resource"], diff_results[0]["attribute"]), ("test-0", "firewalls"))
+        # Open SSH in test-1, test-2 and test-4 (test-3 failed to fetch).
+        self.assertEqual(len(violation_results), 3)
+
+        # The results are the same as analyzing the reports after the run.
+        batch_analyzer = analytics.Analytics(amigo_reporter.reports, amigo_reporter.previous_reports)
+        batch_analyzer.rules_file = RULES_FILE
+
+        self.assertEqual((diff_results, violation_results), batch_analyzer.analyze_reports())
+
+
+    def _get_blobs(self, blobs_dir):
+
+        return sorted(name for path, dirs, names in os.walk(blobs_dir) if os.path.basename(path) != "tmp" for name in names)
+
+
+    def test_content_addressed_reports(self):
+
+        config = self._get_config("blobs", content_addressed_reports=True)
+        blobs_dir = os.path.join(config["reports_dir"], "blobs")
+
+        previous_reporter = self._get_reporter(config, "2018_01_01_00_00_00")
+        previous_reports, _ = previous_reporter.run()
+        self.assertEqual(len(self._get_blobs(blobs_dir)), 8)
+
+        # A firewall of test-0 is no longer open to the world.
+        self._open_firewall("test-0", "10.0.0.0/8")
+
+        amigo_reporter = self._get_reporter(config, "2018_01_02_00_00_00")
+        reports, _ = amigo_reporter.run()
+
+        # The run directory only has the manifest, and only the changed report is a new blob.
+        self.assertEqual(self._get_reports(reports), {})
+        self.assertEqual(len(self._get_blobs(blobs_dir)), 9)
+
+        entry = amigo_reporter.manifest.get("test-2", "firewalls")
+        self.assertEqual(entry["blob"], previous_reporter.manifest.get("test-2", "firewalls")["blob"])
+        self.assertEqual(amigo_reporter.manifest.get_report_path("test-2", "firewalls"),
+                         previous_reporter.manifest.get_report_path("test-2", "firewalls"))
+        self.assertNotEqual(amigo_reporter.manifest.get("test-0", "firewalls")["blob"],
+                            previous_reporter.manifest.get("test-0", "firewalls")["blob"])
+
+        # Analytics reads the reports from the blobs, through the saved manifests.
+        analyzer = analytics.Analytics(reports, previous_reports)
+        analyzer.rules_file = RULES_FILE
+        diff_results, violation_results = analyzer.analyze_reports()
+
+        self.assertEqual([(result["resource"], result["attribute"]) for result in diff_results], [("test-0", "firewalls")])
+        # Open SSH in test-1, test-2 and test-4 (test-3 failed to fetch).
+        self.assertEqual(sorted(result["project"] for result in violation_results), ["test-1", "test-2", "test-4"])
+
+
+    def test_findings_fetch_failed(self):
+
+        config = self._get_config("findings")
+        findings_db = os.path.join(self.tmp_dir, "findings.db")
+
+        def run_and_update(run_id):
+            amigo_reporter = self._get_reporter(config, run_id)
+            amigo_reporter.run()
+
+            analyzer = analytics.Analytics(amigo_reporter.reports, amigo_reporter.previous_reports, manifest=amigo_reporter.manifest)
+            analyzer.rules_file = RULES_FILE
+            violation_results = analyzer.analyze_reports()[1]
+
+            with findings.FindingsStore(findings_db) as store:
+                return store.update(violation_results, run_id, analyzer.report_names)
+
+        # Every fetch succeeds, so there is an open SSH violation in every project.
+        FakeGCPWrapper.reset(FakeGCPWrapper.resources, {})
+        new, resolved, still_open, _ = run_and_update("2018_01_01_00_00_00")
+        self.assertEqual(sorted(finding["project"] for finding in new), ["test-{0}".format(number) for number in range(5)])
+
+        # The firewalls of test-3 fail to fetch, so its violation is still open, not resolved.
+        FakeGCPWrapper.reset(FakeGCPWrapper.resources, {("test-3", "firewalls"): "firewalls of test-3 failed"})
+        new, resolved, still_open, _ = run_and_update("2018_01_02_00_00_00")
+        self.assertEqual((new, resolved), ([], []))
+        self.assertEqual(sorted(finding["project"] for finding in still_open), ["test-{0}".format(number) for number in range(5)])
+
+        # The firewall of test-3 is fetched again and no longer open to the world.
+        self._open_firewall("test-3", "10.0.0.0/8")
+        FakeGCPWrapper.reset(FakeGCPWrapper.resources, {})
+        new, resolved, still_open, _ = run_and_update("2018_01_03_00_00_00")
+        self.assertEqual([finding["project"] for finding in resolved], ["test-3"])
+        self.assertEqual(len(still_open), 4)
+
+
+    def _open_firewall(self, project_name, source_range):
+
+        firewall = FakeGCPWrapper.resources[(project_name, "firewalls")][0]
+        FakeGCPWrapper.resources[(project_name, "firewalls")][0] = dict(firewall, sourceRanges=[source_range])
+
+
+    def _get_full_fetches(self):
+        """
+            Return the (project, attribute) fetched with every field, rather
+            than only their change marker.
+        """
+        return sorted((project, attribute) for project, attribute, fields in FakeGCPWrapper.calls
+                      if attribute != "projects" and fields is None)
+
+
+    def _get_marker_fetches(self):
+        """
+            Return the (project, attribute) whose change marker was fetched.
+        """
+        return sorted((project, attribute) for project, attribute, fields in FakeGCPWrapper.calls
+                      if attribute != "projects" and fields is not None)
+
+
+    def test_change_marker(self):
+
+        amigo_reporter = reporter.Reporter(self._get_config("marker", incremental=True, gcp_fields={"networks": ["IPv4Range"]}))
+
+        self.assertEqual(sorted(amigo_reporter.marker_fields["firewalls"]),
+                         ["allowed", "creationTimestamp", "direction", "disabled", "sourceRanges"])
+        self.assertEqual(amigo_reporter.marker_fields["networks"], ["creationTimestamp", "IPv4Range", "autoCreateSubnetworks"])
+
+        gcp = FakeGCPWrapper(amigo_reporter.config, "compute", "v1")
+        marker = amigo_reporter._get_change_marker(gcp, "firewalls", "test-0")
+
+        # Fields outside the marker do not change it.
+        firewall = FakeGCPWrapper.resources[("test-0", "firewalls")][1]
+        FakeGCPWrapper.resources[("test-0", "firewalls")][1] = dict(firewall, description="ICMP")
+        self.assertEqual(amigo_reporter._get_change_marker(gcp, "firewalls", "test-0"), marker)
+
+        # A firewall opened to more sources does.
+        self._open_firewall("test-0", "0.0.0.0/1")
+        self.assertNotEqual(amigo_reporter._get_change_marker(gcp, "firewalls", "test-0"), marker)
+
+        self.assertEqual(amigo_reporter._get_change_marker(gcp, "firewalls", "test-5"), "")
+        self.assertIsNone(amigo_reporter._get_change_marker(gcp, "firewalls", "test-3"))
+
+
+    def test_incremental_carry_forward(self):
+
+        config = self._get_config("incremental", incremental=True)
+        previous_reporter = self._get_reporter(config, util.get_run_id(days_ago=1))
+        previous_reports, _ = previous_reporter.run()
+
+        # Without previous reports, the markers are computed from the full fetches.
+        self.assertEqual(self._get_marker_fetches(), [])
+        gcp = FakeGCPWrapper(config, "compute", "v1")
+        self.assertEqual(previous_reporter.manifest.get("test-2", "firewalls")["marker"],
+                         previous_reporter._get_change_marker(gcp, "firewalls", "test-2"))
+
+        self._open_firewall("test-0", "0.0.0.0/1")
+        FakeGCPWrapper.calls = []
+
+        amigo_reporter = reporter.Reporter(config)
+        reports, _ = amigo_reporter.run()
+
+        # Only the changed report (and the ones that failed) are fetched again.
+        # The ones that failed have no previous report, so only they skip the marker.
+        self.assertEqual(self._get_full_fetches(), [("test-0", "firewalls"), ("test-1", "networks"), ("test-3", "firewalls")])
+        self.assertEqual(len(self._get_marker_fetches()), 8)
+        self.assertEqual(amigo_reporter.manifest.keys(), previous_reporter.manifest.keys())
+        self.assertEqual(len(self._get_reports(reports)), 8)
+
+        entry = amigo_reporter.manifest.get("test-2", "firewalls")
+        self.assertEqual(entry, previous_reporter.manifest.get("test-2", "firewalls"))
+        self.assertEqual(entry["refreshed"], previous_reporter.run_id)
+        self.assertEqual(amigo_reporter.manifest.get("test-0", "firewalls")["refreshed"], amigo_reporter.run_id)
+
+        # Carried forward resources are in the snapshot of this run too.
+        with database.Database(amigo_reporter.database_path, engine="sqlite") as db:
+            self.assertEqual(db.get_latest_snapshot("firewalls"), amigo_reporter.run_id)
+            self.assertEqual(len(db.get_snapshot("firewalls")), 8)
+            self.assertEqual(len(db.get_snapshot("networks")), 4)
+
+
+    def test_incremental_full_refresh(self):
+
+        config = self._get_config("refresh", incremental=True, full_refresh_days=1)
+        self._get_reporter(config, util.get_run_id(days_ago=2)).run()
+
+        FakeGCPWrapper.calls = []
+        reporter.Reporter(config).run()
+
+        # Reports fully fetched more than full_refresh_days ago are fetched again,
+        # without fetching their change marker first.
+        self.assertEqual(len(self._get_full_fetches()), 10)
+        self.assertEqual(self._get_marker_fetches(), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
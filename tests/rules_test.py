@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   rules_test.py
+#
+#   Test the module rules.py
+#
+
+import unittest
+from amigo.lib import rules
+
+
+class TestRules(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = {
+                "check_firewall_open_all": {
+                    "rule_type": "key_value",
+                    "violation_resource": "firewalls",
+                    "violation": [
+                        {"sourceRanges": "0.0.0.0/0"},
+                        {"allowed[*].IPProtocol": ["tcp", "udp"]},
+                        {"allowed[*].ports": "22"},
+                    ],
+                },
+                "check_network_autoCreateSubnetworks": {
+                    "rule_type": "key_value",
+                    "violation_resource": "networks",
+                    "violation": [{"autoCreateSubnetworks": True}],
+                },
+                "check_unknown_type": {
+                    "rule_type": "unknown",
+                    "violation_resource": "firewalls",
+                    "violation": [],
+                },
+                "check_ill_formatted": {
+                    "rule_type": "key_value",
+                },
+                "check_firewall_ssh_exposed": {
+                    "rule_type": "network_exposure",
+                    "violation_resource": "firewalls",
+                    "violation": {
+                        "source_ranges": ["0.0.0.0/0"],
+                        "trusted_ranges": ["10.0.0.0/8"],
+                        "protocols": ["tcp"],
+                        "ports": [22],
+                    },
+                },
+                "check_ill_formatted_path": {
+                    "rule_type": "key_value",
+                    "violation_resource": "firewalls",
+                    "violation": [{"allowed[*": "tcp"}],
+                },
+            }
+        self.firewall_open = {
+                "name": "default-allow-ssh",
+                "sourceRanges": ["0.0.0.0/0"],
+                "allowed": [{"IPProtocol": "tcp", "ports": ["22"]}],
+            }
+        self.firewall_closed = {
+                "name": "allow-internal",
+                "sourceRanges": ["10.128.0.0/9"],
+                "allowed": [{"IPProtocol": "tcp", "ports": ["0-65535"]}],
+            }
+
+
+    def test_rule_set_compile(self):
+
+        rule_set = rules.RuleSet(self.rules)
+
+        self.assertEqual([rule.name for rule in rule_set.get_rules("firewalls")],
+                         ["check_firewall_open_all", "check_firewall_ssh_exposed"])
+        self.assertEqual(rule_set.get_rules("snapshots"), [])
+        self.assertEqual(rule_set.get_fields("firewalls"), ["sourceRanges", "allowed", "direction", "disabled"])
+
+
+    def test_rule_set_evaluate(self):
+
+        rule_set = rules.RuleSet(self.rules)
+
+        self.assertEqual(len(rule_set.evaluate(self.firewall_open, "firewalls")), 2)
+        self.assertEqual(rule_set.evaluate(self.firewall_closed, "firewalls"), [])
+        self.assertEqual(len(rule_set.evaluate({"autoCreateSubnetworks": True}, "networks")), 1)
+        self.assertEqual(rule_set.evaluate({"autoCreateSubnetworks": False}, "networks"), [])
+
+
+    def test_network_exposure_rule(self):
+
+        rule = rules.RuleSet(self.rules).get_rules("firewalls")[1]
+
+        self.assertTrue(rule.match({"sourceRanges": ["0.0.0.0/1"], "allowed": [{"IPProtocol": "tcp", "ports": ["20-25"]}]}))
+        self.assertTrue(rule.match({"sourceRanges": ["0.0.0.0/0"], "allowed": [{"IPProtocol": "all"}]}))
+        self.assertFalse(rule.match({"sourceRanges": ["0.0.0.0/0"], "allowed": [{"IPProtocol": "udp", "ports": ["22"]}]}))
+        self.assertFalse(rule.match({"sourceRanges": ["0.0.0.0/0"], "allowed": [{"IPProtocol": "tcp", "ports": ["80"]}]}))
+        self.assertFalse(rule.match({"sourceRanges": ["0.0.0.0/0"], "direction": "EGRESS", "allowed": [{"IPProtocol": "tcp"}]}))
+        self.assertFalse(rule.match(self.firewall_closed))
+
+
+    def test_compile_path(self):
+
+        self.assertEqual(rules.compile_path("allowed[*].ports"), ["allowed", "*", "ports"])
+        self.assertEqual(rules.compile_path("allowed[0].IPProtocol"), ["allowed", 0, "IPProtocol"])
+        self.assertEqual(rules.compile_path("routingConfig.routingMode"), ["routingConfig", "routingMode"])
+        self.assertRaises(ValueError, rules.compile_path, "allowed[*")
+
+
+    def test_resolve_path(self):
+
+        values = list(rules.resolve_path(self.firewall_open, rules.compile_path("allowed[*].ports")))
+
+        self.assertEqual(values, [["22"]])
+        self.assertEqual(list(rules.resolve_path(self.firewall_open, ["missing"])), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   sinks_test.py
+#
+#   Test the module sinks.py
+#
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from amigo.lib import util
+from amigo.lib import sinks
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.results_path = os.path.join(self.tmp_dir, "amigo.log")
+
+        self.violation = {
+                "name": "Violation for firewalls in test-163318",
+                "resource": "firewalls",
+                "project": "test-163318",
+                "violation": {
+                    "rule": "check_firewall_open_all",
+                    "resource_data": {"id": "1111"},
+                },
+            }
+        self.diff = {"name": "Difference in Resources", "resource": "test-163318", "attribute": "networks", "diff": {}}
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_get_result_fields(self):
+
+        self.assertEqual(sinks.get_result_fields(self.violation),
+                         ("check_firewall_open_all", "test-163318", "firewalls", "id:1111"))
+        self.assertEqual(sinks.get_result_fields(self.diff), (None, "test-163318", "networks", None))
+
+
+    def test_jsonl_sink(self):
+
+        for result in [self.violation, self.diff]:
+            with sinks.JSONLinesSink(self.results_path) as sink:
+                sink.write(result)
+
+        try:
+            with sinks.JSONLinesSink(self.results_path) as sink:
+                sink.write(self.violation)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(util.read_jsonl_file(self.results_path), [self.violation, self.diff])
+        self.assertEqual(os.listdir(self.tmp_dir), ["amigo.log"])
+
+
+    def test_jsonl_sink_append(self):
+
+        # The results of previous runs are never read again.
+        with open(self.results_path, "w") as f:
+            f.write("previous\n")
+
+        with sinks.JSONLinesSink(self.results_path) as sink:
+            sink.write(self.violation)
+
+        with open(self.results_path) as f:
+            self.assertEqual(f.readline(), "previous\n")
+            self.assertEqual(util.json_loads(f.readline()), self.violation)
+
+
+    def test_jsonl_sink_compressed(self):
+
+        extensions = [".gz", ".zst"] if util.zstandard is not None else [".gz"]
+
+        for extension in extensions:
+            results_path = self.results_path + extension
+
+            for result in [self.violation, self.diff]:
+                with sinks.JSONLinesSink(results_path) as sink:
+                    sink.write(result)
+
+            self.assertEqual(util.read_jsonl_file(results_path), [self.violation, self.diff])
+
+
+    def test_sharded_sink(self):
+
+        with sinks.get_results_sink({"results_sink": "sharded"}, self.results_path, "2018_01_01_00_00_00") as sink:
+            sink.write(self.diff)
+
+        self.assertEqual(util.read_jsonl_file(os.path.join(self.tmp_dir, "amigo.2018_01_01_00_00_00.log")), [self.diff])
+
+
+    def test_sqlite_sink(self):
+
+        with sinks.get_results_sink({"results_sink": "sqlite"}, self.results_path, "2018_01_01_00_00_00") as sink:
+            sink.write(self.violation)
+            sink.write(self.diff)
+
+        connection = sqlite3.connect(os.path.join(self.tmp_dir, "results.db"))
+        rows = connection.execute("SELECT project, resource FROM results WHERE rule = ?", ("check_firewall_open_all",)).fetchall()
+        connection.close()
+
+        self.assertEqual(rows, [("test-163318", "firewalls")])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
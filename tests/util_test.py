@@ -6,6 +6,9 @@
 #   Test the module util.py
 #
 
+import os
+import shutil
+import tempfile
 import unittest
 from amigo.lib import util
 
@@ -72,6 +75,73 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(test_diff_dict1_to_2, diff_dict1_to_2)
 
 
+    def test_get_content_hash(self):
+
+        reordered_dict = dict(reversed(list(self.network_dict.items())))
+
+        self.assertEqual(util.get_content_hash(self.network_dict), util.get_content_hash(reordered_dict))
+        self.assertNotEqual(util.get_content_hash(self.network_dict), util.get_content_hash(self.network_dict_2))
+
+
+    def test_get_run_id(self):
+
+        self.assertTrue(util.get_run_id(7) < util.get_run_id())
+        self.assertEqual(len(util.get_run_id()), len("2018_01_01_00_00_00"))
+
+
+    def test_set_json_codec(self):
+
+        self.assertEqual(util.set_json_codec("json"), "json")
+        self.assertEqual(util.json_loads(util.json_dumps(self.network_dict)), self.network_dict)
+        self.assertEqual(util.set_json_codec("unknown"), "json")
+        self.assertIn(util.set_json_codec("auto"), util.JSON_CODECS_PREFERENCE)
+        self.assertEqual(util.json_loads(util.json_dumps(self.network_dict)), self.network_dict)
+
+
+    def test_save_to_jsonl_file_compressed(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        items = [self.network_dict, self.network_dict_2]
+
+        try:
+            for report_file in ["test@networks.jsonl", "test@networks.jsonl.gz"]:
+                report_path = os.path.join(tmp_dir, report_file)
+
+                self.assertEqual(util.save_to_jsonl_file(iter(items), report_path), 2)
+                self.assertEqual(util.read_jsonl_file(report_path), items)
+                self.assertEqual(util.extract_resource_info(report_path), ("test", "networks"))
+
+            self.assertIsNone(util.extract_resource_info(os.path.join(tmp_dir, "networks.jsonl")))
+
+            empty_path = os.path.join(tmp_dir, "empty.jsonl")
+            open(empty_path, "w").close()
+            self.assertEqual(util.read_jsonl_file(empty_path), [])
+
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_save_to_jsonl_file_error(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        report_path = os.path.join(tmp_dir, "test@networks.jsonl")
+
+        def iter_items():
+            yield self.network_dict
+            raise ValueError("interrupted")
+
+        try:
+            # Items that cannot be serialized are not saved.
+            self.assertEqual(util.save_to_jsonl_file([self.network_dict, object()], report_path), 0)
+            self.assertRaises(ValueError, util.save_to_jsonl_file, iter_items(), report_path)
+            self.assertEqual(util.save_to_jsonl_file([], report_path), 0)
+
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file